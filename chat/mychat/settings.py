@@ -209,3 +209,66 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Cache shared by every worker and the websocket process, permission resolver (access.py) and public
+# servers list (context_processor.py) are invalidated through it
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": "redis://127.0.0.1:6379/1",
+    },
+}
+
+# Chat messages persistence
+# Write-behind saves messages in batches (higher throughput). Queued messages and batch being saved are
+# written on normal exit, they are lost if process is killed. Set VIPERCHAT_MESSAGE_WRITE_BEHIND = False
+# to save every message immediately.
+
+VIPERCHAT_MESSAGE_WRITE_BEHIND = True
+VIPERCHAT_MESSAGE_BATCH_SIZE = 100
+VIPERCHAT_MESSAGE_FLUSH_INTERVAL = 0.05     # seconds
+
+# Websocket rate limits, (messages per second, burst)
+
+VIPERCHAT_RATE_LIMIT_CONNECTION = (5, 10)
+VIPERCHAT_RATE_LIMIT_USER = (10, 20)
+VIPERCHAT_RATE_LIMIT_SUBSCRIBE = (5, 50)     # multiplexed socket subscriptions, burst covers VIPERCHAT_MULTIPLEX_MAX_STREAMS
+VIPERCHAT_RATE_LIMIT_MAX_STRIKES = 20       # over limit frames in a row before socket is closed
+VIPERCHAT_RATE_LIMIT_LOG_INTERVAL = 60      # seconds between log lines with totals of shed frames and closed sockets
+
+# Room presence, join/leave changes are broadcast at most once per interval (seconds).
+# Presence is tracked per process and sent only to that process's sockets, with several workers
+# each user sees online members connected to the same worker.
+
+VIPERCHAT_PRESENCE_BROADCAST_INTERVAL = 1.0
+
+# Chat history, messages per page in room/chat page and websocket history requests
+
+VIPERCHAT_HISTORY_PAGE_SIZE = 50
+VIPERCHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+# Recent room frames kept in memory for clients resuming after reconnect
+
+VIPERCHAT_REPLAY_BUFFER_SIZE = 500
+VIPERCHAT_REPLAY_MAX_ROOMS = 1000           # least recently used rooms are dropped from memory
+
+# Typing indicators, one aggregated frame per room per interval (seconds)
+
+VIPERCHAT_TYPING_INTERVAL = 1.0
+VIPERCHAT_TYPING_TIMEOUT = 6.0
+VIPERCHAT_TYPING_MAX_USERS = 5              # usernames listed in one frame
+VIPERCHAT_TYPING_MAX_FANOUT = 200           # rooms with more online users get no typing frames
+
+# One websocket for many rooms and chats (ws/chat/), streams one connection may subscribe
+
+VIPERCHAT_MULTIPLEX_MAX_STREAMS = 50
+
+# Server permissions resolver, role and permission codenames of user in server are kept in shared cache
+# (CACHES default) and invalidated by version bump on every group or permission change
+
+VIPERCHAT_SERVER_PERMISSIONS_CACHE_TIMEOUT = 300    # seconds
+
+# Public servers list given to every template (context_processor.py), kept in cache until a server changes
+
+VIPERCHAT_PUBLIC_SERVERS_CACHE_TIMEOUT = 300    # seconds
@@ -0,0 +1,203 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Subquery, Value
+from django.db.models.functions import Concat
+
+from .events import group_send_on_commit
+from .models import ServerMembership
+
+#   Socket closed because user has lost access to room
+ACCESS_REVOKED_CLOSE_CODE = 4003
+
+SERVER_ROLES = tuple(role for role, label in ServerMembership.ROLES)
+
+
+class RoomAccess:
+    """
+    Permissions of one user in one room, computed once when websocket connects.
+    Same rules as RoomDetail: public room needs server membership, private room needs
+    display_private_room_data, sending needs send_messages_in_server.
+    """
+    __slots__ = ('can_view', 'can_send')
+
+    def __init__(self, can_view=False, can_send=False):
+        self.can_view = can_view
+        self.can_send = can_send
+
+
+class ServerPermissions:
+    """
+    Role and permission codenames of one user in one server, role is None if user is not a member.
+    Templates can test codenames with `'send_invitation' in permissions`.
+    """
+    __slots__ = ('role', 'codenames')
+
+    def __init__(self, role=None, codenames=()):
+        self.role = role
+        self.codenames = frozenset(codenames)
+
+    @property
+    def is_member(self):
+        return self.role is not None
+
+    def has(self, *codenames):
+        return self.codenames.issuperset(codenames)
+
+    def __contains__(self, codename):
+        return codename in self.codenames
+
+
+def server_group_names(server):
+    return [f'{server.name}_{role}' for role in SERVER_ROLES]
+
+
+def server_permissions_version_key(server_id):
+    return f'viperchat:server_permissions_version:{server_id}'
+
+
+def server_permissions_version(server_id):
+    """
+    Version is bumped on every group or permission change in server, so cached entries of old
+    version are never read again. First version is a timestamp, an evicted version key can't
+    bring back entries cached before eviction.
+    """
+    key = server_permissions_version_key(server_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_server_permissions(server_id):
+    def bump():
+        try:
+            cache.incr(server_permissions_version_key(server_id))
+        except ValueError:
+            cache.set(server_permissions_version_key(server_id), time.time_ns(), None)
+    bump()
+    #   Again after commit, request running before commit could have cached permissions from before the change
+    transaction.on_commit(bump)
+
+
+def load_role_codenames(server, role):
+    return tuple(Permission.objects.filter(group__name=f'{server.name}_{role}').values_list('codename', flat=True))
+
+
+def role_codenames(server, role):
+    """Permission codenames of role group, shared by all users of role, cached under server version"""
+    key = f'viperchat:role_permissions:{server.pk}:{role}:{server_permissions_version(server.pk)}'
+    codenames = cache.get(key)
+    if codenames is None:
+        codenames = load_role_codenames(server, role)
+        cache.set(key, codenames, getattr(settings, 'VIPERCHAT_SERVER_PERMISSIONS_CACHE_TIMEOUT', 300))
+    return codenames
+
+
+def load_server_permissions(user_id, server):
+    """
+    One query: UNION of membership role and permission codenames of its role group,
+    rows are (name, is_codename). Non-member gets no rows.
+    """
+    membership = ServerMembership.objects.filter(server=server, user=user_id)
+    role_group = Concat(Value(f'{server.name}_'), Subquery(membership.values('role')[:1]))
+    rows = list(membership.values_list('role', Value(False)).order_by().union(
+        Permission.objects.filter(group__name=role_group).values_list('codename', Value(True)).order_by(), all=True
+    ))
+    role = next((name for name, is_codename in rows if not is_codename), None)
+    if role is None:
+        return ServerPermissions()
+    return ServerPermissions(role, [name for name, is_codename in rows if is_codename])
+
+
+def cached_server_permissions(user_id, server):
+    """Shared cache first, database on miss"""
+    key = f'viperchat:server_permissions:{server.pk}:{user_id}:{server_permissions_version(server.pk)}'
+    cached = cache.get(key)
+    if cached is not None:
+        return ServerPermissions(*cached)
+    permissions = load_server_permissions(user_id, server)
+    cache.set(key, (permissions.role, tuple(permissions.codenames)),
+              getattr(settings, 'VIPERCHAT_SERVER_PERMISSIONS_CACHE_TIMEOUT', 300))
+    return permissions
+
+
+def server_permissions(user, server):
+    """
+    Role and permissions of user in server, every view and template tag asks here.
+    Result is kept on user instance, like Django's _perm_cache, so request.user resolves each
+    server once per request. Long living users (websocket scope) should use cached_server_permissions.
+    """
+    if not user.is_authenticated:
+        return ServerPermissions()
+    memo = server_permissions_memo(user)
+    permissions = memo.get(server.pk)
+    if permissions is None:
+        permissions = memo[server.pk] = cached_server_permissions(user.pk, server)
+    return permissions
+
+
+def server_permissions_memo(user):
+    memo = getattr(user, '_server_permissions_cache', None)
+    if memo is None:
+        memo = user._server_permissions_cache = {}
+    return memo
+
+
+def prime_server_permissions(users, server):
+    """
+    Resolves many users of one server with one membership query, later server_permissions()
+    calls on these instances don't touch database. Used by member lists.
+    """
+    users = [user for user in users if server.pk not in server_permissions_memo(user)]
+    if not users:
+        return
+    roles = dict(ServerMembership.objects.filter(server=server, user__in=[user.pk for user in users])
+                                         .values_list('user_id', 'role'))
+    #   Codenames are resolved once per role, not per listed user
+    codenames = {role: role_codenames(server, role) for role in set(roles.values())}
+    for user in users:
+        role = roles.get(user.pk)
+        server_permissions_memo(user)[server.pk] = \
+            ServerPermissions(role, codenames[role]) if role is not None else ServerPermissions()
+
+
+def room_access(user, room, cached=True):
+    """
+    At most one query, room must have server loaded.
+    cached=False skips cache, revocations must not depend on other processes seeing version bump.
+    """
+    if not user.is_authenticated:
+        return RoomAccess()
+    if cached:
+        permissions = cached_server_permissions(user.pk, room.server)
+    else:
+        permissions = load_server_permissions(user.pk, room.server)
+    if room.is_private:
+        can_view = 'display_private_room_data' in permissions
+    else:
+        can_view = permissions.is_member
+    return RoomAccess(can_view, can_view and 'send_messages_in_server' in permissions)
+
+
+def access_user_group(user_id):
+    """Channel layer group of every room socket of one user"""
+    return f'access_user_{user_id}'
+
+
+def access_server_group(server_id):
+    """Channel layer group of every room socket in one server"""
+    return f'access_server_{server_id}'
+
+
+def publish_access_change(server, user=None):
+    """
+    Tells live room sockets of user, or of whole server if user is None, to recompute RoomAccess.
+    Event is sent after transaction commits, so consumers read new permissions.
+    """
+    group = access_server_group(server.id) if user is None else access_user_group(user.pk)
+    group_send_on_commit(group, {"type": "access.changed", "server_id": str(server.id)})
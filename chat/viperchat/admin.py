@@ -3,7 +3,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
 from .models import Room, Notification, FriendRequest, Message, ServerPermissionSettings, Server, UserPermissionSettings, \
-      ServerInvite, Chat
+      ServerInvite, Chat, ServerMembership
 from .forms import UserCreationForm, UserChangeForm
 
 
@@ -27,6 +27,7 @@ admin.site.register(FriendRequest)
 admin.site.register(Message)
 admin.site.register(ServerPermissionSettings)
 admin.site.register(Server)
+admin.site.register(ServerMembership)
 admin.site.register(UserPermissionSettings)
 admin.site.register(ServerInvite)
 admin.site.register(Chat)
\ No newline at end of file
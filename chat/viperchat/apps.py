@@ -6,4 +6,12 @@ class ViperchatConfig(AppConfig):
     name = 'viperchat'
 
     def ready(self):
-        import viperchat.signals
\ No newline at end of file
+        import atexit
+        from django.db.models.signals import post_migrate
+        import viperchat.signals
+        from viperchat.permission_registry import permission_registry
+        from viperchat.persistence import message_writer
+        #   Save buffered chat messages before worker process exits
+        atexit.register(message_writer.flush_on_shutdown)
+        #   Migrations may add or recreate permission rows
+        post_migrate.connect(permission_registry.refresh, dispatch_uid='viperchat_permission_registry_refresh')
\ No newline at end of file
@@ -1,105 +1,637 @@
-import json
+import uuid
 
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 
+from .events import room_group_name, chat_group_name
+from .access import RoomAccess, ACCESS_REVOKED_CLOSE_CODE, access_server_group, access_user_group, room_access
 from .models import Message, Room, Server, Chat
+from .notifications import notification_group
+from .pagination import messages_before
+from .protocol import MSGPACK_SUBPROTOCOL, encode, decode, chat_message_frames, history_frame, stream_frame
+from .persistence import message_writer
+from .presence import presence
+from .replay import replay
+from .typing_indicators import typing_coordinator
+from .throttling import ConnectionThrottle, RATE_LIMIT_CLOSE_CODE, shed_counters
 
 
 User = get_user_model()
 
-class RoomChatConsumer(AsyncWebsocketConsumer):
+#   Users chat is always between two participants, both may be online
+DIRECT_CHAT_PARTICIPANTS = 2
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Common part of room and users chat consumers.
+    Clients which offer MSGPACK_SUBPROTOCOL get MessagePack binary frames, others JSON text frames.
+    """
+    binary = False
+
+    async def websocket_connect(self, message):
+        self.throttle = ConnectionThrottle(getattr(self.scope.get("user"), "pk", None))
+        await super().websocket_connect(message)
+
+    async def throttled(self):
+        """
+        Checked for every frame before its type is looked at.
+        Returns True if frame is over the limit, client gets error frame or socket is closed
+        """
+        return await self.shed(self.throttle.check())
+
+    async def in_slow_mode(self, room):
+        return await self.shed(self.throttle.check_slow_mode(room))
+
+    async def shed(self, result):
+        """Answers frame rejected by throttle, result of ConnectionThrottle check"""
+        if result is None:
+            return False
+        if self.throttle.exceeded:
+            #   Frames already in flight after close are dropped silently
+            if not self.throttle.closed:
+                self.throttle.closed = True
+                shed_counters.add('connections_closed')
+                await self.close(code=RATE_LIMIT_CLOSE_CODE)
+        else:
+            reason, retry_after = result
+            await self.send_data({"error": reason, "retry_after": retry_after})
+        return True
+
+    async def accept_negotiated(self):
+        self.binary = MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", [])
+        await self.accept(MSGPACK_SUBPROTOCOL if self.binary else None)
+
+    async def send_data(self, data):
+        """Encodes frame for this connection protocol"""
+        if self.binary:
+            await self.send(bytes_data=encode(data, binary=True))
+        else:
+            await self.send(text_data=encode(data))
+
+    async def send_frame(self, frame):
+        """Forwards frame pre-serialized by sender (protocol.frames)"""
+        if self.binary:
+            await self.send(bytes_data=frame["bytes"])
+        else:
+            await self.send(text_data=frame["text"])
+
+    def update_typing(self, request):
+        """
+        {"type": "typing", "state": "start" | "stop"}, relayed as coalesced frame (typing_indicators.py)
+        """
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            return
+        if request.get("state") == "stop":
+            typing_coordinator.stop(self.typing_key, user, self.channel_layer, self.room_group_name)
+        elif self.online_count() <= typing_coordinator.max_fanout:
+            typing_coordinator.start(self.typing_key, user, self.channel_layer, self.room_group_name)
+
+    async def typing_update(self, event):
+        await self.send_frame(event)
+
+    # Edited or deleted message (events.publish_message_edit)
+    async def message_edit(self, event):
+        await self.send_frame(event)
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'typing_key'):
+            self.update_typing({"state": "stop"})
+        # Leave room group
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+
+    async def send_history(self, queryset, request):
+        """
+        Answer for {"type": "history", "before": cursor, "limit": N}, used by infinite scroll
+        """
+        page, cursor = await get_history(queryset, request.get("before"), request.get("limit"))
+        if self.binary:
+            await self.send(bytes_data=history_frame(page, cursor, binary=True))
+        else:
+            await self.send(text_data=history_frame(page, cursor))
+
+
+class RoomChatConsumer(ChatConsumer):
     async def connect(self):
         self.server_id = self.scope["url_route"]["kwargs"]["server_id"]
         self.room_id = self.scope["url_route"]["kwargs"]["pk"]
         self.room_group_name = f"chat_{self.server_id}_{self.room_id}"
+        # Resolve room once, unknown room or server rejects handshake
+        self.room = await get_room(self.server_id, self.room_id)
+        if self.room is None:
+            await self.close()
+            return
+        # Permissions snapshot, checked on every frame without database query
+        self.access = await get_room_access(self.scope["user"], self.room)
+        if not self.access.can_view:
+            await self.close()
+            return
+        self.typing_key = self.room.id
+        # Revocations are pushed by views (access.publish_access_change)
+        self.access_groups = [access_user_group(self.scope["user"].pk), access_server_group(self.room.server_id)]
+        for group in self.access_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        replay.seed(self.room.id, self.room.last_sequence)
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        await self.accept()
+        await self.accept_negotiated()
+        self.tracks_presence = self.scope["user"].is_authenticated
+        if self.tracks_presence:
+            presence.join(self.room.id, self.scope["user"], self.presence_update, self.room_group_name)
+            await self.presence_update(presence.snapshot(self.room.id, self.room_group_name))
 
     async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, 'tracks_presence', False):
+            presence.leave(self.room.id, self.scope["user"], self.presence_update)
+        for group in getattr(self, 'access_groups', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+        await super().disconnect(close_code)
+
+    def online_count(self):
+        return presence.count(self.room.id)
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
-        username = self.scope["user"].username
-        room = await get_room(self.room_id)
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_group_name, {"type": "chat.message", "message": message, 'username': username}
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = decode(text_data, bytes_data)
+        if await self.throttled():
+            return
+        if text_data_json.get("type") == "history":
+            await self.send_history(Message.objects.filter(room=self.room), text_data_json)
+            return
+        if text_data_json.get("type") == "resume":
+            await self.resume(text_data_json.get("last_seq"))
+            return
+        if not is_valid_request(text_data_json):
+            await self.send_data({"error": "invalid_request"})
+            return
+        if not self.access.can_send:
+            #   Read-only connection, typing frames are ignored too
+            if text_data_json.get("type") != "typing":
+                await self.send_data({"error": "forbidden"})
+            return
+        if text_data_json.get("type") == "typing":
+            self.update_typing(text_data_json)
+            return
+        if await self.in_slow_mode(self.room):
+            return
+        self.update_typing({"state": "stop"})
+        await publish_room_message(
+            self.channel_layer, self.room_group_name, self.room, self.scope["user"], text_data_json["message"]
         )
-        await save_room_message(self.scope['user'], message, room)
+
+    async def resume(self, last_sequence):
+        """
+        Sends frames client missed while disconnected, database is used only if gap is older than ring buffer
+        """
+        try:
+            last_sequence = int(last_sequence)
+        except (TypeError, ValueError):
+            await self.send_data({"error": "invalid_sequence"})
+            return
+        frames, complete = await missed_frames(self.room, last_sequence)
+        for frame in frames:
+            await self.send_frame(frame)
+        #   Incomplete resume means client should reload whole room
+        await self.send_data({"resumed": {"complete": complete}})
 
     # Receive message from room group
     async def chat_message(self, event):
-        message = event["message"]
-        username = event['username']
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"message":f'{username}: {message}'}))
+        replay.remember(self.room.id, event["seq"], {"text": event["text"], "bytes": event["bytes"]})
+        # Send ready frame to WebSocket
+        await self.send_frame(event)
+
+    async def access_changed(self, event):
+        """User rights in server have changed, snapshot is recomputed or socket closed"""
+        if event["server_id"] != str(self.room.server_id):
+            return
+        room = await get_room(self.server_id, self.room_id)
+        access = RoomAccess() if room is None else await get_fresh_room_access(self.scope["user"], room)
+        if not access.can_view:
+            self.access = access
+            await self.close(code=ACCESS_REVOKED_CLOSE_CODE)
+            return
+        self.room, self.access = room, access
 
+    # Online list and coalesced join/leave changes, called by presence tracker of this process (presence.py)
+    async def presence_update(self, event):
+        await self.send_frame(event)
 
-class UserChatConsumer(AsyncWebsocketConsumer):
+
+class UserChatConsumer(ChatConsumer):
     """
     Send and save messages between two users
     """
     async def connect(self):
         self.chat_id = self.scope["url_route"]["kwargs"]["pk"]
         self.room_group_name = f"chat_{self.chat_id}"
+        # Resolve chat once, unknown chat or user who is not participant rejects handshake
+        self.chat = await get_chat(self.chat_id, self.scope["user"])
+        if self.chat is None:
+            await self.close()
+            return
+        self.typing_key = self.chat.id
         # Join room group
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
 
-        await self.accept()
-
-    async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self.accept_negotiated()
 
     # Receive message from WebSocket
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json["message"]
-        username = self.scope["user"].username
-        chat = await get_chat(self.chat_id)
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_group_name, {"type": "chat.message", "message": message, 'username': username}
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = decode(text_data, bytes_data)
+        if await self.throttled():
+            return
+        if text_data_json.get("type") == "history":
+            await self.send_history(Message.objects.filter(chat=self.chat), text_data_json)
+            return
+        if not is_valid_request(text_data_json):
+            await self.send_data({"error": "invalid_request"})
+            return
+        if text_data_json.get("type") == "typing":
+            self.update_typing(text_data_json)
+            return
+        self.update_typing({"state": "stop"})
+        await publish_chat_message(
+            self.channel_layer, self.room_group_name, self.chat, self.scope["user"], text_data_json["message"]
         )
-        await save_user_profile_message(self.scope['user'], message, chat)
+
+    def online_count(self):
+        return DIRECT_CHAT_PARTICIPANTS
 
     # Receive message from room group
     async def chat_message(self, event):
-        message = event["message"]
-        username = event['username']
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({"message":f'{username}: {message}'}))
+        # Send ready frame to WebSocket
+        await self.send_frame(event)
 
+class Subscription:
+    """One room or chat stream of multiplexed connection"""
+    __slots__ = ('stream', 'group_name', 'room', 'chat', 'access')
 
-@database_sync_to_async
-def save_room_message(author, content, room):
-    if content == '':
+    def __init__(self, stream, group_name, access, room=None, chat=None):
+        self.stream = stream
+        self.group_name = group_name
+        self.access = access
+        self.room = room
+        self.chat = chat
+
+    @property
+    def typing_key(self):
+        return self.room.id if self.room is not None else self.chat.id
+
+
+class MultiplexChatConsumer(ChatConsumer):
+    """
+    One connection of user for many rooms and chats, instead of socket per room.
+    Client subscribes with {"type": "subscribe", "stream": "room:<id>" | "chat:<id>"} and leaves
+    with {"type": "unsubscribe", "stream": ...}. Messages, history, resume and typing requests
+    have the same format as in single room consumers plus "stream" key, frames of streams
+    come as {"stream": ..., "frame": ...}. User's notifications come as "notifications" stream.
+    """
+    async def connect(self):
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            await self.close()
+            return
+        self.subscriptions = {}
+        #   Channel layer group name -> stream, events carry group they were sent to
+        self.group_streams = {}
+        await self.channel_layer.group_add(access_user_group(user.pk), self.channel_name)
+        await self.channel_layer.group_add(notification_group(user.pk), self.channel_name)
+        await self.accept_negotiated()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'subscriptions'):
+            return
+        for stream in list(self.subscriptions):
+            await self.unsubscribe(stream)
+        await self.channel_layer.group_discard(access_user_group(self.scope["user"].pk), self.channel_name)
+        await self.channel_layer.group_discard(notification_group(self.scope["user"].pk), self.channel_name)
+
+    @property
+    def max_streams(self):
+        return getattr(settings, 'VIPERCHAT_MULTIPLEX_MAX_STREAMS', 50)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        request = decode(text_data, bytes_data)
+        stream = request.get("stream")
+        if request.get("type") == "subscribe":
+            await self.subscribe(stream)
+            return
+        if request.get("type") == "unsubscribe":
+            if await self.shed(self.throttle.check_subscribe()):
+                return
+            if stream in self.subscriptions:
+                await self.unsubscribe(stream)
+            await self.send_data({"unsubscribed": stream})
+            return
+        if await self.throttled():
+            return
+        subscription = self.subscriptions.get(stream)
+        if subscription is None:
+            await self.send_data({"error": "not_subscribed", "stream": stream})
+            return
+        if request.get("type") == "history":
+            await self.send_stream_history(subscription, request)
+            return
+        if request.get("type") == "resume" and subscription.room is not None:
+            await self.resume_stream(subscription, request.get("last_seq"))
+            return
+        if not is_valid_request(request):
+            await self.send_data({"error": "invalid_request", "stream": stream})
+            return
+        if not subscription.access.can_send:
+            if request.get("type") != "typing":
+                await self.send_data({"error": "forbidden", "stream": stream})
+            return
+        if request.get("type") == "typing":
+            self.update_stream_typing(subscription, request)
+            return
+        if subscription.room is not None and await self.in_slow_mode(subscription.room):
+            return
+        self.update_stream_typing(subscription, {"state": "stop"})
+        if subscription.room is not None:
+            await publish_room_message(
+                self.channel_layer, subscription.group_name, subscription.room, self.scope["user"], request["message"]
+            )
+        else:
+            await publish_chat_message(
+                self.channel_layer, subscription.group_name, subscription.chat, self.scope["user"], request["message"]
+            )
+
+    async def subscribe(self, stream):
+        #   Subscribing costs database queries, it has own limit, charged for every subscribe frame
+        if await self.shed(self.throttle.check_subscribe()):
+            return
+        if stream in self.subscriptions:
+            await self.send_data({"subscribed": stream})
+            return
+        if len(self.subscriptions) >= self.max_streams:
+            await self.send_data({"error": "too_many_streams", "stream": stream})
+            return
+        subscription = await self.resolve(stream)
+        if subscription is None:
+            await self.send_data({"error": "forbidden", "stream": stream})
+            return
+        user = self.scope["user"]
+        if subscription.room is not None:
+            replay.seed(subscription.room.id, subscription.room.last_sequence)
+            await self.channel_layer.group_add(access_server_group(subscription.room.server_id), self.channel_name)
+        await self.channel_layer.group_add(subscription.group_name, self.channel_name)
+        self.subscriptions[stream] = subscription
+        self.group_streams[subscription.group_name] = stream
+        await self.send_data({"subscribed": stream})
+        if subscription.room is not None:
+            presence.join(subscription.room.id, user, self.presence_update, subscription.group_name)
+            await self.presence_update(presence.snapshot(subscription.room.id, subscription.group_name))
+
+    async def resolve(self, stream):
+        """Subscription for "room:<id>" or "chat:<id>" stream, None if it doesn't exist or user has no access"""
+        kind, _, object_id = str(stream).partition(':')
+        try:
+            object_id = uuid.UUID(object_id)
+        except ValueError:
+            return None
+        user = self.scope["user"]
+        if kind == 'room':
+            room = await get_room_by_id(object_id)
+            if room is None:
+                return None
+            access = await get_room_access(user, room)
+            if not access.can_view:
+                return None
+            return Subscription(stream, room_group_name(room), access, room=room)
+        if kind == 'chat':
+            chat = await get_chat(object_id, user)
+            if chat is None:
+                return None
+            return Subscription(stream, chat_group_name(chat), RoomAccess(True, True), chat=chat)
+        return None
+
+    async def unsubscribe(self, stream):
+        subscription = self.subscriptions.pop(stream)
+        del self.group_streams[subscription.group_name]
+        user = self.scope["user"]
+        typing_coordinator.stop(subscription.typing_key, user, self.channel_layer, subscription.group_name)
+        await self.channel_layer.group_discard(subscription.group_name, self.channel_name)
+        room = subscription.room
+        if room is not None:
+            presence.leave(room.id, user, self.presence_update)
+            #   Server group is kept while any other room of the server is subscribed
+            if not any(other.room is not None and other.room.server_id == room.server_id
+                       for other in self.subscriptions.values()):
+                await self.channel_layer.group_discard(access_server_group(room.server_id), self.channel_name)
+
+    def update_stream_typing(self, subscription, request):
+        user = self.scope["user"]
+        if request.get("state") == "stop":
+            typing_coordinator.stop(subscription.typing_key, user, self.channel_layer, subscription.group_name)
+        elif subscription.room is None or presence.count(subscription.room.id) <= typing_coordinator.max_fanout:
+            typing_coordinator.start(subscription.typing_key, user, self.channel_layer, subscription.group_name)
+
+    async def send_stream_history(self, subscription, request):
+        if subscription.room is not None:
+            queryset = Message.objects.filter(room=subscription.room)
+        else:
+            queryset = Message.objects.filter(chat=subscription.chat)
+        page, cursor = await get_history(queryset, request.get("before"), request.get("limit"))
+        if self.binary:
+            await self.send_stream_frame(subscription.stream, {"bytes": history_frame(page, cursor, binary=True)})
+        else:
+            await self.send_stream_frame(subscription.stream, {"text": history_frame(page, cursor)})
+
+    async def resume_stream(self, subscription, last_sequence):
+        try:
+            last_sequence = int(last_sequence)
+        except (TypeError, ValueError):
+            await self.send_data({"error": "invalid_sequence", "stream": subscription.stream})
+            return
+        frames, complete = await missed_frames(subscription.room, last_sequence)
+        for frame in frames:
+            await self.send_stream_frame(subscription.stream, frame)
+        await self.send_data({"stream": subscription.stream, "frame": {"resumed": {"complete": complete}}})
+
+    async def send_stream_frame(self, stream, frame):
+        if self.binary:
+            await self.send(bytes_data=stream_frame(stream, frame, binary=True))
+        else:
+            await self.send(text_data=stream_frame(stream, frame))
+
+    async def forward(self, event):
+        """Frame from subscribed group, dropped if stream was unsubscribed meanwhile"""
+        stream = self.group_streams.get(event["group"])
+        if stream is not None:
+            await self.send_stream_frame(stream, event)
+        return stream
+
+    async def chat_message(self, event):
+        stream = await self.forward(event)
+        if stream is not None and "seq" in event:
+            room = self.subscriptions[stream].room
+            replay.remember(room.id, event["seq"], {"text": event["text"], "bytes": event["bytes"]})
+
+    async def presence_update(self, event):
+        await self.forward(event)
+
+    # User's notifications come as "notifications" stream without subscribing
+    async def notification_push(self, event):
+        await self.send_stream_frame("notifications", event)
+
+    async def typing_update(self, event):
+        await self.forward(event)
+
+    async def message_edit(self, event):
+        await self.forward(event)
+
+    async def access_changed(self, event):
+        """Rooms of the server where user has lost access are unsubscribed, connection stays open"""
+        for stream, subscription in list(self.subscriptions.items()):
+            room = subscription.room
+            if room is None or str(room.server_id) != event["server_id"]:
+                continue
+            room = await get_room_by_id(room.id)
+            access = RoomAccess() if room is None else await get_fresh_room_access(self.scope["user"], room)
+            if access.can_view:
+                subscription.room, subscription.access = room, access
+            else:
+                await self.unsubscribe(stream)
+                await self.send_data({"unsubscribed": stream, "reason": "forbidden"})
+
+
+class NotificationConsumer(ChatConsumer):
+    """
+    Pushes new notifications and unread count changes of logged user (notifications.py)
+    """
+    async def connect(self):
+        user = self.scope["user"]
+        self.room_group_name = notification_group(user.pk)
+        if not user.is_authenticated:
+            await self.close()
+            return
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept_negotiated()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Push only socket
         pass
-    else:
-        return Message.objects.create(author=author, content=content, room=room)
-    
+
+    async def notification_push(self, event):
+        await self.send_frame(event)
+
+
+def is_valid_request(request):
+    """Typing frame or message, other request types are answered before this check"""
+    if request.get("type") is None:
+        return "message" in request
+    return request.get("type") == "typing"
+
+
+async def publish_room_message(channel_layer, group_name, room, author, content):
+    """Numbers message, sends it to room group and queues it for saving"""
+    sequence = await next_sequence(room)
+    message = Message(author=author, content=content, room=room, sequence=sequence)
+    frame = chat_message_frames(author, content, sequence, message_id=message.id)
+    replay.remember(room.id, sequence, frame)
+    # Frame is serialized once for every recipient
+    await channel_layer.group_send(group_name, {"type": "chat.message", "group": group_name, "seq": sequence, **frame})
+    await save_message(message)
+
+
+async def publish_chat_message(channel_layer, group_name, chat, author, content):
+    message = Message(author=author, content=content, chat=chat)
+    await channel_layer.group_send(group_name, {
+        "type": "chat.message", "group": group_name, **chat_message_frames(author, content, message_id=message.id)
+    })
+    await save_message(message)
+
+
+async def missed_frames(room, last_sequence):
+    """
+    Frames after last_sequence and False if client should reload whole room,
+    database is used only if gap is older than ring buffer
+    """
+    frames = replay.since(room.id, last_sequence)
+    if frames is not None:
+        return frames, True
+    await message_writer.flush()
+    return await get_missed_frames(room, last_sequence)
+
+
+async def save_message(message):
+    """Message is saved by write-behind writer (persistence.py), empty ones are only broadcast"""
+    if message.content == '':
+        return None
+    await message_writer.save(message)
+    return message
+
+
+def room_sequence_key(room_id):
+    return f'viperchat:room_sequence:{room_id}'
+
+
+async def next_sequence(room):
+    """
+    Next number of room message, one atomic increment in shared cache (Redis INCR) used by every
+    worker process, no database round trip. Missing counter starts from Room.last_sequence,
+    checkpoint written by message writer with every saved batch (persistence.py).
+    """
+    key = room_sequence_key(room.id)
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await seed_sequence(room)
+        return await cache.aincr(key)
+
 
 @database_sync_to_async
-def get_room(room_id):
-    return Room.objects.get(id=room_id)
+def seed_sequence(room):
+    last_sequence = Room.objects.filter(pk=room.pk).values_list('last_sequence', flat=True).first() or 0
+    #   add() doesn't overwrite counter seeded meanwhile by another process
+    cache.add(room_sequence_key(room.id), last_sequence, None)
 
 
 @database_sync_to_async
-def save_user_profile_message(author, content, chat):
-    if content == '':
-        pass
-    else:
-        return Message.objects.create(author=author, content=content, chat=chat)
-     
+def get_missed_frames(room, last_sequence):
+    """Returns frames from database and False if there is more than one history page of them"""
+    limit = getattr(settings, 'VIPERCHAT_HISTORY_MAX_PAGE_SIZE', 200)
+    messages = list(Message.objects.filter(room=room, sequence__gt=last_sequence)
+                    .select_related('author').order_by('sequence')[:limit + 1])
+    frames = [chat_message_frames(message.author, message.content, message.sequence,
+                                  message.date_created.timestamp(), message.id)
+              for message in messages[:limit]]
+    return frames, len(messages) <= limit
+
+
+@database_sync_to_async
+def get_room(server_id, room_id):
+    """Returns None if room doesn't exist or belongs to another server"""
+    return Room.objects.select_related('server').filter(id=room_id, server_id=server_id).first()
+
+
+@database_sync_to_async
+def get_room_by_id(room_id):
+    return Room.objects.select_related('server').filter(id=room_id).first()
+
+
+get_room_access = database_sync_to_async(room_access)
+
+
+@database_sync_to_async
+def get_fresh_room_access(user, room):
+    """Access from database, used after access change event"""
+    return room_access(user, room, cached=False)
+
+
+@database_sync_to_async
+def get_chat(chat_id, user):
+    if not user.is_authenticated:
+        return None
+    return Chat.objects.filter(id=chat_id, participants=user).first()
+
 
 @database_sync_to_async
-def get_chat(chat_id):
-    return Chat.objects.get(id=chat_id)
\ No newline at end of file
+def get_history(queryset, cursor, limit):
+    return messages_before(queryset.select_related('author'), cursor, limit)
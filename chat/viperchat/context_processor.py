@@ -1,14 +1,35 @@
-from typing import Any, Dict
-from django.contrib.auth.models import Group, Permission
-from django.contrib.contenttypes.models import ContentType
-from django.views.generic import DetailView
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
 
 from .models import Server
+from .permission_registry import permission_registry
+
+"""
+Processors run on every render, values are lazy: nothing is loaded unless template uses it
+"""
+
+PUBLIC_SERVERS_CACHE_KEY = 'viperchat:public_servers'
+
+
+def public_servers():
+    """Public servers list, shared through cache, dropped on every Server save and delete (signals.py)"""
+    servers = cache.get(PUBLIC_SERVERS_CACHE_KEY)
+    if servers is None:
+        servers = list(Server.objects.filter(is_private=False))
+        cache.set(PUBLIC_SERVERS_CACHE_KEY, servers, getattr(settings, 'VIPERCHAT_PUBLIC_SERVERS_CACHE_TIMEOUT', 300))
+    return servers
+
+
+def invalidate_public_servers():
+    cache.delete(PUBLIC_SERVERS_CACHE_KEY)
+    #   Again after commit, request running before commit could have cached old list
+    transaction.on_commit(lambda: cache.delete(PUBLIC_SERVERS_CACHE_KEY))
 
 
 def get_create_room_permission(request):
-    content_type = ContentType.objects.get_for_model(Server)
-    permission = Permission.objects.get(codename='create_room_in_server', content_type=content_type)
+    permission = SimpleLazyObject(lambda: permission_registry.get('create_room_in_server', Server))
     return {'create_permission': permission}
 
 
@@ -17,19 +38,19 @@ def get_homepage(request):
 
 
 def get_server_list(request):
-    public_servers = Server.objects.filter(is_private=False)
-    return {'server_list': public_servers}
+    public_servers_list = SimpleLazyObject(public_servers)
+    return {'server_list': public_servers_list}
 
 
 def get_edit_permissions(request):
-    permission = Permission.objects.get(codename='edit_permissions_in_server')
+    permission = SimpleLazyObject(lambda: permission_registry.get('edit_permissions_in_server'))
     return {'edit_permissions': permission}
 
 
 def get_delete_user(request):
-    permission = Permission.objects.get(codename='delete_user_from_server')
+    permission = SimpleLazyObject(lambda: permission_registry.get('delete_user_from_server'))
     return {'delete_users_permission': permission}
 
 def get_send_invite_permission(request):
-    permission = Permission.objects.get(codename='send_invitation')
-    return {'send_invitation_permission': permission}
\ No newline at end of file
+    permission = SimpleLazyObject(lambda: permission_registry.get('send_invitation'))
+    return {'send_invitation_permission': permission}
@@ -0,0 +1,52 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+
+from .protocol import message_edit_frames
+
+
+logger = logging.getLogger(__name__)
+
+
+def group_send_on_commit(group, event):
+    """
+    Sends channel layer event from synchronous code (views, signals) after transaction commits,
+    so consumers never see data which may still be rolled back
+    """
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(group, event)
+        except Exception:
+            #   Data is already saved, clients see it after reload
+            logger.exception('Sending %s event to %s failed', event.get("type"), group)
+    transaction.on_commit(send)
+
+
+def room_group_name(room):
+    return f"chat_{room.server_id}_{room.id}"
+
+
+def chat_group_name(chat):
+    return f"chat_{chat.id}"
+
+
+def message_group_name(message):
+    if message.room_id is not None:
+        return room_group_name(message.room)
+    return chat_group_name(message.chat)
+
+
+def publish_message_edit(message):
+    """Sends new content of edited message to its room or chat group"""
+    group = message_group_name(message)
+    group_send_on_commit(group, {"type": "message.edit", "group": group, **message_edit_frames(message)})
+
+
+def publish_message_delete(message):
+    """Sends tombstone of deleted message, called before instance loses its id"""
+    group = message_group_name(message)
+    message.date_edited = timezone.now()
+    group_send_on_commit(group, {"type": "message.edit", "group": group, **message_edit_frames(message, deleted=True)})
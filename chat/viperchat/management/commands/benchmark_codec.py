@@ -0,0 +1,47 @@
+import json
+import time
+from types import SimpleNamespace
+
+import msgpack
+from django.core.management.base import BaseCommand
+
+from viperchat.protocol import chat_message_frames, decode, encode
+
+
+class Command(BaseCommand):
+    help = 'Compares size and encode/decode cost of JSON and MessagePack chat message frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lengths', nargs='+', type=int, default=[10, 100, 1000],
+                            help='Message content lengths in characters')
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        author = SimpleNamespace(pk=12345, username='benchmark_user')
+        iterations = options['iterations']
+        self.stdout.write(
+            f'{"length":>8} {"text bytes":>11} {"json bytes":>11} {"msgpack bytes":>14} '
+            f'{"json enc us":>12} {"msgpack enc us":>15} {"json dec us":>12} {"msgpack dec us":>15}'
+        )
+        for length in options['lengths']:
+            content = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit ' * (length // 56 + 1))[:length]
+            frame = chat_message_frames(author, content, 123456)
+            #   Same structured fields as binary frame, encoded as JSON
+            data = msgpack.unpackb(frame["bytes"], raw=False)
+            json_frame = encode(data)
+            json_encode = self.measure(lambda: encode(data), iterations)
+            msgpack_encode = self.measure(lambda: encode(data, binary=True), iterations)
+            json_decode = self.measure(lambda: json.loads(json_frame), iterations)
+            msgpack_decode = self.measure(lambda: decode(bytes_data=frame["bytes"]), iterations)
+            self.stdout.write(
+                f'{length:>8} {len(frame["text"].encode()):>11} {len(json_frame.encode()):>11} '
+                f'{len(frame["bytes"]):>14} {json_encode:>12.3f} {msgpack_encode:>15.3f} '
+                f'{json_decode:>12.3f} {msgpack_decode:>15.3f}'
+            )
+
+    def measure(self, function, iterations):
+        """CPU microseconds per call"""
+        start = time.process_time()
+        for _ in range(iterations):
+            function()
+        return (time.process_time() - start) / iterations * 1e6
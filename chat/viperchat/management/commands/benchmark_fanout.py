@@ -0,0 +1,73 @@
+import asyncio
+import json
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from viperchat.consumers import RoomChatConsumer
+from viperchat.protocol import chat_message_frames
+from viperchat.replay import replay
+
+
+async def legacy_chat_message(consumer, event):
+    """Previous handler: every recipient serialized the frame itself"""
+    message = event["message"]
+    username = event['username']
+    await consumer.send(text_data=json.dumps({"message":f'{username}: {message}'}))
+
+
+class Command(BaseCommand):
+    help = 'Measures CPU cost per recipient of delivering one room message, depending on room size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 500, 2000, 5000])
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent to the room per size')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"room size":>10} {"legacy us/recipient":>20} {"pre-serialized us/recipient":>28}')
+        for size in options['sizes']:
+            legacy, current = asyncio.run(self.measure(size, options['messages']))
+            self.stdout.write(f'{size:>10} {legacy:>20.3f} {current:>28.3f}')
+
+    async def measure(self, size, messages):
+        content = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit ' * 2
+        author = SimpleNamespace(pk=1, username='benchmark_user')
+        #   Room with full replay ring, like a room which has been busy for a while
+        room = SimpleNamespace(id=uuid.uuid4())
+        replay.seed(room.id, 0)
+        for sequence in range(1, replay.size + 1):
+            replay.remember(room.id, sequence, chat_message_frames(author, content, sequence))
+        sequence = replay.size
+        recipients = [self.recipient(room) for _ in range(size)]
+        legacy_time = 0
+        current_time = 0
+        for _ in range(messages):
+            #   Legacy path: raw fields in event, serialized per recipient
+            event = {"type": "chat.message", "message": content, "username": 'benchmark_user'}
+            start = time.process_time()
+            for consumer in recipients:
+                await legacy_chat_message(consumer, event)
+            legacy_time += time.process_time() - start
+            #   Current path: frame serialized once and remembered by sender, every recipient
+            #   remembers it again (replay.py) before sending
+            sequence += 1
+            start = time.process_time()
+            frame = chat_message_frames(author, content, sequence)
+            replay.remember(room.id, sequence, frame)
+            event = {"type": "chat.message", "seq": sequence, **frame}
+            for consumer in recipients:
+                await consumer.chat_message(event)
+            current_time += time.process_time() - start
+        deliveries = size * messages
+        return legacy_time / deliveries * 1e6, current_time / deliveries * 1e6
+
+    def recipient(self, room):
+        consumer = RoomChatConsumer()
+        consumer.room = room
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            pass
+        consumer.send = send
+        return consumer
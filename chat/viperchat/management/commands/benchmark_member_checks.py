@@ -0,0 +1,243 @@
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from viperchat.access import SERVER_ROLES, server_group_names, server_permissions
+from viperchat.models import Server, ServerMembership, ServerPermissionSettings
+from viperchat.utils import assignable_member_roles, can_change_member_group, can_delete_member, \
+    check_if_logged_user_can_change_users_group, check_if_logged_user_can_delete_user, create_server_groups, \
+    deletable_members, initial_server_permissions, server_member_actions
+
+
+User = get_user_model()
+
+
+class QueryCounter:
+    """Counts executed queries, query log of connection keeps only the last 9000"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return self.count
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def legacy_can_delete_user(logged_user, user_to_delete, server):
+    """Previous check_if_logged_user_can_delete_user: group memberships and permissions loaded per comparison"""
+    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
+    permission_settings = server.permission_settings
+    owners_group = Group.objects.get(name=f'{server.name}_owners')
+    masters_group = Group.objects.get(name=f'{server.name}_masters')
+    members_group = Group.objects.get(name=f'{server.name}_members')
+
+    owners_delete_permissions = [
+        Permission.objects.get(codename='delete_masters_from_server'),
+        Permission.objects.get(codename='delete_moderators_from_server'),
+        Permission.objects.get(codename='delete_members_from_server')
+    ]
+
+    masters_delete_permissions = [
+        Permission.objects.get(codename='delete_moderators_from_server'),
+        Permission.objects.get(codename='delete_members_from_server')
+    ]
+
+    moderator_delete_permissions = [
+        Permission.objects.get(codename='delete_members_from_server')
+    ]
+
+    for group in server_groups:
+        if user_to_delete in owners_group.user_set.all():
+            return False
+        #   Owners group
+        if logged_user in group.user_set.all() and \
+        all(permission in group.permissions.all() for permission in owners_delete_permissions):
+            if user_to_delete in owners_group.user_set.all():   #   Delete owners is prohibited
+                return False
+            else:
+                return True
+        #   Masters group
+        if logged_user in group.user_set.all() and \
+        all(permission in group.permissions.all() for permission in masters_delete_permissions):
+            #   Check if masters have permission to delete user
+            if permission_settings.masters_delete_user == 'Forbidden' or \
+            user_to_delete in owners_group.user_set.all() or \
+            user_to_delete in masters_group.user_set.all():
+                return False
+            else:
+                return True
+        #   Moderators group
+        if logged_user in group.user_set.all()  \
+        and all(permission in group.permissions.all() for permission in moderator_delete_permissions):
+            #   Check if moderators have permission to delete user
+            if user_to_delete in members_group.user_set.all() and permission_settings.moderators_delete_user == 'Allowed':
+                return True
+            else:
+                return False
+
+
+def legacy_can_change_users_group(logged_user, user_to_change, server, destined_group):
+    """Previous check_if_logged_user_can_change_users_group"""
+    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
+    permission_settings = server.permission_settings
+    owners_group = Group.objects.get(name=f'{server.name}_owners')
+    masters_group = Group.objects.get(name=f'{server.name}_masters')
+
+    owners_change_permissions = [
+        Permission.objects.get(codename='edit_moderators_group'),
+        Permission.objects.get(codename='edit_members_group'),
+        Permission.objects.get(codename='edit_masters_group')
+    ]
+
+    masters_change_permissions = [
+        Permission.objects.get(codename='edit_moderators_group'),
+        Permission.objects.get(codename='edit_members_group'),
+    ]
+    #   masters have no permission to promote to masters or owners
+    if logged_user in masters_group.user_set.all():
+        if destined_group == owners_group or destined_group == masters_group:
+            return False
+
+    for group in server_groups:
+        if user_to_change in owners_group.user_set.all():
+            return False
+        #   Owners group
+        if logged_user in group.user_set.all() and \
+        all(permission in group.permissions.all() for permission in owners_change_permissions):
+            if user_to_change in owners_group.user_set.all():   #   Change owners is prohibited
+                return False
+            else:
+                return True
+        #   Masters group
+        if logged_user in group.user_set.all() and \
+        all(permission in group.permissions.all() for permission in masters_change_permissions):
+            #   Check if masters have permission to change users group
+            if permission_settings.masters_can_edit_users_group == 'Forbidden' or \
+            user_to_change in owners_group.user_set.all() or \
+            user_to_change in masters_group.user_set.all():
+                return False
+            else:
+                return True
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares previous group based delete/change group checks, per-user checks over permission snapshot '
+        'and set based member list evaluation on synthetic servers in test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', nargs='+', type=int, default=[100, 1000, 5000])
+        parser.add_argument('--iterations', type=int, default=20, help='Repeats of pure rule evaluation')
+        parser.add_argument('--legacy-max-members', type=int, default=1000,
+                            help='Larger servers skip previous implementation, it loads group members per check')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        self.stdout.write(
+            f'{"members":>8} {"legacy ms":>10} {"legacy queries":>15} {"per-user ms":>12} {"per-user queries":>17} '
+            f'{"batch ms":>9} {"batch queries":>14} {"pure us/member":>15} {"vector us/member":>17}'
+        )
+        for size in options['members']:
+            server, owner = self.create_server(size)
+            groups = list(Group.objects.filter(name__in=server_group_names(server)))
+
+            legacy, legacy_queries = '-', '-'
+            if size <= options['legacy_max_members']:
+                owner, members = self.load_users(server)
+                start = time.perf_counter()
+                with count_queries() as queries:
+                    for member in members:
+                        legacy_can_delete_user(owner, member, server)
+                        for group in groups:
+                            legacy_can_change_users_group(owner, member, server, group)
+                legacy = f'{(time.perf_counter() - start) * 1000:.1f}'
+                legacy_queries = len(queries)
+
+            cache.clear()
+            owner, members = self.load_users(server)
+            start = time.perf_counter()
+            with count_queries() as per_user_queries:
+                for member in members:
+                    check_if_logged_user_can_delete_user(owner, member, server)
+                    for group in groups:
+                        check_if_logged_user_can_change_users_group(owner, member, server, group)
+            per_user = time.perf_counter() - start
+
+            cache.clear()
+            owner, members = self.load_users(server)
+            start = time.perf_counter()
+            with count_queries() as batch_queries:
+                server_member_actions(owner, server, members, groups)
+            batch = time.perf_counter() - start
+
+            #   Rules alone, on roles already resolved
+            permissions = server_permissions(owner, server)
+            roles = [member.member_actions.role for member in members]
+            settings = server.permission_settings
+            pure = self.measure(lambda: [
+                (can_delete_member(permissions, role, settings),
+                 [can_change_member_group(permissions, role, destined, settings) for destined in SERVER_ROLES])
+                for role in roles
+            ], options['iterations']) / size
+            vector = self.measure(lambda: (
+                deletable_members(permissions, roles, settings), assignable_member_roles(permissions, roles, settings)
+            ), options['iterations']) / size
+            self.stdout.write(
+                f'{size:>8} {legacy:>10} {legacy_queries:>15} {per_user * 1000:>12.1f} {len(per_user_queries):>17} '
+                f'{batch * 1000:>9.1f} {len(batch_queries):>14} {pure:>15.3f} {vector:>17.3f}'
+            )
+
+    def create_server(self, size):
+        owner = User.objects.create(username=f'benchmark_owner_{size}')
+        server = Server.objects.create(
+            name=f'benchmark_{size}', creator=owner, permission_settings=ServerPermissionSettings.objects.create()
+        )
+        groups = dict(zip(SERVER_ROLES, create_server_groups(server)))
+        initial_server_permissions(*groups.values())
+        members = User.objects.bulk_create([User(username=f'benchmark_{size}_{number}') for number in range(size)])
+        roles = SERVER_ROLES[1:]
+        memberships = ServerMembership.objects.bulk_create(
+            [ServerMembership(server=server, user=owner, role='owners')] +
+            [ServerMembership(server=server, user=member, role=roles[number % len(roles)])
+             for number, member in enumerate(members)]
+        )
+        #   Previous implementation reads roles from group members
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=membership.user_id, group_id=groups[membership.role].pk)
+            for membership in memberships
+        ])
+        return server, owner
+
+    def load_users(self, server):
+        """Fresh instances, nothing resolved on them yet"""
+        owner = User.objects.get(pk=server.creator_id)
+        return owner, list(server.users.exclude(pk=owner.pk))
+
+    def measure(self, function, iterations):
+        """CPU microseconds per call"""
+        start = time.process_time()
+        for _ in range(iterations):
+            function()
+        return (time.process_time() - start) / iterations * 1e6
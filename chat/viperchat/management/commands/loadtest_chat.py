@@ -0,0 +1,219 @@
+import asyncio
+import json
+import time
+
+import msgpack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from viperchat.models import Chat, Message, Room, Server, ServerPermissionSettings
+from viperchat.persistence import message_writer
+from viperchat.protocol import MSGPACK_SUBPROTOCOL
+from viperchat.routing import websocket_urlpatterns
+from viperchat.utils import initial_server_permissions
+
+
+User = get_user_model()
+
+
+class WriteCounter:
+    """Counts INSERT/UPDATE/DELETE statements on every database connection opened during the run"""
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.statements += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Client:
+    """One simulated websocket client, records latency of every chat message it receives"""
+    def __init__(self, communicator, binary, result):
+        self.communicator = communicator
+        self.binary = binary
+        self.result = result
+
+    async def receive(self):
+        while True:
+            output = await self.communicator.receive_output(timeout=None)
+            if output["type"] != "websocket.send":
+                return
+            if self.binary:
+                data = msgpack.unpackb(output["bytes"], raw=False)
+                content = data.get("message", {}).get("content") if "message" in data else None
+            else:
+                data = json.loads(output["text"])
+                content = data["message"].split(': ', 1)[1] if "message" in data else None
+            if content is not None:
+                self.result.delivered(time.perf_counter() - float(content))
+
+
+class CaseResult:
+    def __init__(self, expected):
+        self.expected = expected
+        self.latencies = []
+        self.sent = 0
+        self.last_delivery = None
+        self.done = asyncio.Event()
+
+    def delivered(self, latency):
+        self.latencies.append(latency)
+        self.last_delivery = time.perf_counter()
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return float('nan')
+        latencies = sorted(self.latencies)
+        return latencies[int(fraction * (len(latencies) - 1))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drives simulated websocket clients against RoomChatConsumer and UserChatConsumer '
+        'with in-memory channel layer and test database, sweeps room size and message rate. '
+        'Clients run in the same process, so numbers include their own overhead.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', nargs='+', choices=['room', 'chat'], default=['room', 'chat'])
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 200],
+                            help='Connected clients, in one room or in pairs of user chats')
+        parser.add_argument('--rates', nargs='+', type=int, default=[10, 50],
+                            help='Messages per second sent to every room or chat')
+        parser.add_argument('--duration', type=float, default=3, help='Seconds of sending per case')
+        parser.add_argument('--senders', type=int, default=5, help='Clients sending messages in a room')
+        parser.add_argument('--drain-timeout', type=float, default=10,
+                            help='Seconds to wait for outstanding deliveries after sending has stopped')
+        parser.add_argument('--binary', action='store_true', help='Clients negotiate MessagePack subprotocol')
+        parser.add_argument('--no-write-behind', action='store_true',
+                            help='Save every message before consumer continues')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        counter = WriteCounter()
+        connection_created.connect(counter.install)
+        #   Load must not be cut by rate limits, rooms have slow mode off
+        unlimited = (10 ** 9, 10 ** 9)
+        try:
+            with override_settings(
+                CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+                VIPERCHAT_RATE_LIMIT_CONNECTION=unlimited,
+                VIPERCHAT_RATE_LIMIT_USER=unlimited,
+                VIPERCHAT_MESSAGE_WRITE_BEHIND=not options['no_write_behind'],
+            ):
+                self.run(options, counter)
+        finally:
+            connection_created.disconnect(counter.install)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options, counter):
+        users = [User.objects.create(username=f'loadtest{number}') for number in range(max(options['sizes']))]
+        server = Server.objects.create(
+            name='loadtest', creator=users[0], permission_settings=ServerPermissionSettings.objects.create()
+        )
+        #   Every client is a member allowed to send messages
+        groups = [Group.objects.create(name=f'{server.name}_{role}')
+                  for role in ('owners', 'masters', 'moderators', 'members')]
+        initial_server_permissions(*groups)
+        server.users.add(*users)
+        self.stdout.write(
+            f'{"consumer":>8} {"clients":>8} {"rate":>6} {"sent":>7} {"delivered":>10} {"lost":>6} '
+            f'{"frames/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"db rows":>8} {"db writes":>10}'
+        )
+        for consumer in options['consumers']:
+            for size in options['sizes']:
+                for rate in options['rates']:
+                    if consumer == 'room':
+                        groups = self.room_groups(server, users[:size])
+                    else:
+                        groups = self.chat_groups(users[:size])
+                    rows_before = Message.objects.count()
+                    writes_before = counter.statements
+                    result, elapsed = asyncio.run(self.run_case(groups, rate, options))
+                    rows = Message.objects.count() - rows_before
+                    writes = counter.statements - writes_before
+                    received = len(result.latencies)
+                    self.stdout.write(
+                        f'{consumer:>8} {size:>8} {rate:>6} {result.sent:>7} {received:>10} '
+                        f'{result.expected - received:>6} {received / elapsed:>10.0f} '
+                        f'{result.percentile(0.5) * 1000:>8.2f} {result.percentile(0.99) * 1000:>8.2f} '
+                        f'{rows:>8} {writes:>10}'
+                    )
+
+    def room_groups(self, server, users):
+        """All clients in one room, first clients send"""
+        room = Room.objects.create(name='loadtest', server=server)
+        return [(f'/ws/server/{server.id}/rooms/{room.id}/', users)]
+
+    def chat_groups(self, users):
+        """Clients in pairs, one user chat per pair"""
+        groups = []
+        for first, second in zip(users[::2], users[1::2]):
+            chat = Chat.objects.create()
+            chat.participants.add(first, second)
+            groups.append((f'/ws/users-chat/{chat.id}/', [first, second]))
+        return groups
+
+    async def run_case(self, groups, rate, options):
+        messages = int(rate * options['duration'])
+        result = CaseResult(sum(messages * len(users) for path, users in groups))
+        subprotocols = [MSGPACK_SUBPROTOCOL] if options['binary'] else None
+        application = URLRouter(websocket_urlpatterns)
+        clients = []
+        for path, users in groups:
+            group = []
+            for user in users:
+                communicator = WebsocketCommunicator(application, path, subprotocols=subprotocols)
+                communicator.scope['user'] = user
+                connected, code = await communicator.connect()
+                if not connected:
+                    raise RuntimeError(f'Connection to {path} refused with code {code}')
+                group.append(Client(communicator, options['binary'], result))
+            clients.append(group)
+        receivers = [asyncio.create_task(client.receive()) for group in clients for client in group]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            self.send(group[:options['senders']], rate, messages, result) for group in clients
+        ))
+        try:
+            await asyncio.wait_for(result.done.wait(), options['drain_timeout'])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = (result.last_delivery or time.perf_counter()) - start
+
+        for receiver in receivers:
+            receiver.cancel()
+        for group in clients:
+            for client in group:
+                await client.communicator.disconnect()
+        await message_writer.flush()
+        return result, elapsed
+
+    async def send(self, senders, rate, messages, result):
+        """Round robin over senders at constant rate, message content is send time"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for number in range(messages):
+            await asyncio.sleep(max(0, start + number / rate - loop.time()))
+            sender = senders[number % len(senders)]
+            content = repr(time.perf_counter())
+            if sender.binary:
+                await sender.communicator.send_to(bytes_data=msgpack.packb({"message": content}))
+            else:
+                await sender.communicator.send_to(text_data=json.dumps({"message": content}))
+            result.sent += 1
+
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viperchat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='slow_mode',
+            field=models.PositiveIntegerField(default=0, help_text='Seconds between messages of one user, 0 disables'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viperchat', '0002_room_slow_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'sequence'], name='viperchat_m_room_id_816188_idx'),
+        ),
+    ]
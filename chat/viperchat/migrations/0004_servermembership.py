@@ -0,0 +1,81 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ROLES = ('owners', 'masters', 'moderators', 'members')
+
+
+def memberships_from_groups(apps, schema_editor):
+    """Role of every server user from `{server.name}_{role}` group, users without group become members"""
+    Server = apps.get_model('viperchat', 'Server')
+    Group = apps.get_model('auth', 'Group')
+    ServerMembership = apps.get_model('viperchat', 'ServerMembership')
+    OldServerUsers = Server._meta.get_field('old_users').remote_field.through
+    memberships = []
+    for server in Server.objects.all():
+        roles = {}
+        #   Lower role first, user in several groups keeps the highest one
+        for role in reversed(ROLES):
+            group = Group.objects.filter(name=f'{server.name}_{role}').first()
+            if group is not None:
+                roles.update((user_id, role) for user_id in group.user_set.values_list('pk', flat=True))
+                group.user_set.clear()
+        user_ids = set(OldServerUsers.objects.filter(server=server).values_list('user_id', flat=True))
+        memberships += [ServerMembership(server=server, user_id=user_id, role=roles.get(user_id, 'members'))
+                        for user_id in user_ids | set(roles)]
+    ServerMembership.objects.bulk_create(memberships)
+
+
+def groups_from_memberships(apps, schema_editor):
+    Server = apps.get_model('viperchat', 'Server')
+    Group = apps.get_model('auth', 'Group')
+    ServerMembership = apps.get_model('viperchat', 'ServerMembership')
+    OldServerUsers = Server._meta.get_field('old_users').remote_field.through
+    for membership in ServerMembership.objects.select_related('server'):
+        group, created = Group.objects.get_or_create(name=f'{membership.server.name}_{membership.role}')
+        group.user_set.add(membership.user_id)
+        OldServerUsers.objects.get_or_create(server_id=membership.server_id, user_id=membership.user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('viperchat', '0003_message_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServerMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('owners', 'Owners'), ('masters', 'Masters'), ('moderators', 'Moderators'), ('members', 'Members')], default='members', max_length=20)),
+                ('server', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='viperchat.server')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='server_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='servermembership',
+            constraint=models.UniqueConstraint(fields=('server', 'user'), name='unique_server_membership'),
+        ),
+        #   Old auto created users table stays until data is copied, its field can't be altered to use through model
+        migrations.RenameField(
+            model_name='server',
+            old_name='users',
+            new_name='old_users',
+        ),
+        migrations.RunPython(memberships_from_groups, groups_from_memberships),
+        migrations.RemoveField(
+            model_name='server',
+            name='old_users',
+        ),
+        migrations.AddField(
+            model_name='server',
+            name='users',
+            field=models.ManyToManyField(blank=True, through='viperchat.ServerMembership', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
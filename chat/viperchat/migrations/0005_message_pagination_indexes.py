@@ -0,0 +1,25 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viperchat', '0004_servermembership'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'date_created', 'id'], name='viperchat_m_room_id_0ef024_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'date_created', 'id'], name='viperchat_m_chat_id_091de6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'author', 'date_created'], name='viperchat_m_room_id_0b0f57_idx'),
+        ),
+    ]
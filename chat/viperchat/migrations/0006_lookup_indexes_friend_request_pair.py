@@ -0,0 +1,49 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:10
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def delete_duplicate_friend_requests(apps, schema_editor):
+    """Oldest request of every pair of users is kept, constraint below can't be added over duplicates"""
+    FriendRequest = apps.get_model('viperchat', 'FriendRequest')
+    seen = set()
+    duplicates = []
+    for request_id, sender_id, receiver_id in FriendRequest.objects.exclude(sender=None) \
+            .order_by('date_created').values_list('id', 'sender_id', 'receiver_id'):
+        pair = frozenset((sender_id, receiver_id))
+        if pair in seen:
+            duplicates.append(request_id)
+        seen.add(pair)
+    FriendRequest.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viperchat', '0005_message_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendrequest',
+            index=models.Index(fields=['sender', 'receiver'], name='viperchat_f_sender__1fe58a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['receiver', 'is_read', '-date_created'], name='viperchat_n_receive_50db8a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['receiver', '-date_created'], name='viperchat_n_receive_8d70d7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serverinvite',
+            index=models.Index(fields=['server', 'receiver'], name='viperchat_s_server__cb4cc7_idx'),
+        ),
+        migrations.RunPython(delete_duplicate_friend_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='friendrequest',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Least('sender', 'receiver'), django.db.models.functions.comparison.Greatest('sender', 'receiver'), condition=models.Q(('sender__isnull', False)), name='unique_friend_request_pair'),
+        ),
+    ]
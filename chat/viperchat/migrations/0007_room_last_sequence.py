@@ -0,0 +1,30 @@
+# Generated by Django 4.2.5 on 2026-10-18 21:02
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def seed_last_sequence(apps, schema_editor):
+    """Numbering continues after last saved message of every room"""
+    Room = apps.get_model('viperchat', 'Room')
+    Message = apps.get_model('viperchat', 'Message')
+    last_sequence = Message.objects.filter(room=OuterRef('pk')).values('room') \
+        .annotate(last=Max('sequence')).values('last')
+    Room.objects.update(last_sequence=Coalesce(Subquery(last_sequence), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viperchat', '0006_lookup_indexes_friend_request_pair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_sequence',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(seed_last_sequence, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group
+from django.db.models.functions import Greatest, Least
 
 import uuid
 
@@ -71,7 +72,7 @@ class Server(models.Model):
     name = models.CharField(max_length=155, unique=True)
     description = models.TextField(null=True, blank=True)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='server_creator')
-    users = models.ManyToManyField(User, blank=True)
+    users = models.ManyToManyField(User, blank=True, through='ServerMembership')
     permission_settings = models.OneToOneField(ServerPermissionSettings, on_delete=models.CASCADE, null=True, blank=True)
     is_private = models.BooleanField(default=True)
 
@@ -92,10 +93,42 @@ class Server(models.Model):
             ('edit_rooms_in_server', 'Can change rooms data in server'),
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        #   Name as saved in database, server groups are renamed when it changes (signals.py)
+        instance = super().from_db(db, field_names, values)
+        instance.saved_name = instance.name
+        return instance
+
     def __str__(self):
         return self.name
 
 
+class ServerMembership(models.Model):
+    """
+    User's role in server, one row per server user.
+    Permissions of every role are kept in server's role group (`{server.name}_{role}`)
+    """
+    ROLES = [
+        ('owners', 'Owners'),
+        ('masters', 'Masters'),
+        ('moderators', 'Moderators'),
+        ('members', 'Members'),
+    ]
+
+    server = models.ForeignKey(Server, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='server_memberships')
+    role = models.CharField(max_length=20, choices=ROLES, default='members')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['server', 'user'], name='unique_server_membership'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} ({self.role}) in {self.server}'
+
+
 class Room(models.Model):
     id = models.UUIDField(
         default=uuid.uuid4,
@@ -107,6 +140,8 @@ class Room(models.Model):
     description = models.TextField()
     is_private = models.BooleanField(default=False)
     server = models.ForeignKey(Server, on_delete=models.CASCADE)
+    slow_mode = models.PositiveIntegerField(default=0, help_text='Seconds between messages of one user, 0 disables')
+    last_sequence = models.PositiveBigIntegerField(default=0)    # Last saved Message.sequence, checkpoint of cache counter
 
     class Meta:
         permissions = [
@@ -144,11 +179,19 @@ class Message(models.Model):
     content = models.TextField()
     date_created = models.DateTimeField(auto_now_add=True)
     date_edited = models.DateTimeField(null=True, blank=True)
+    sequence = models.PositiveBigIntegerField(null=True, blank=True)     # Order of message in room (replay.py)
 
     class Meta:
         permissions = [
             ("delete_message_from_server", "Can delete message from server"),
         ]
+        indexes = [
+            models.Index(fields=['room', 'sequence']),
+            #   Keyset pagination (pagination.py) of room, chat and own messages
+            models.Index(fields=['room', 'date_created', 'id']),
+            models.Index(fields=['chat', 'date_created', 'id']),
+            models.Index(fields=['room', 'author', 'date_created']),
+        ]
 
     def __str__(self):
         return self.content
@@ -166,6 +209,20 @@ class Notification(models.Model):
     receiver = models.ForeignKey(User, on_delete=models.CASCADE)
     is_read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            #   Notification lists and unread count, newest first
+            models.Index(fields=['receiver', 'is_read', '-date_created']),
+            models.Index(fields=['receiver', '-date_created']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        #   Saved is_read value, change of it is pushed as unread count delta (signals.py)
+        instance.saved_is_read = instance.__dict__.get('is_read')
+        return instance
+
     def __str__(self):
         return self.description
 
@@ -188,6 +245,18 @@ class FriendRequest(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     status = models.CharField(choices=CHOICES, max_length=64, default='waiting')
 
+    class Meta:
+        indexes = [
+            #   Pair is probed in both directions, (sender, receiver) index serves both
+            models.Index(fields=['sender', 'receiver']),
+        ]
+        constraints = [
+            #   One request per pair of users, whoever sent it. LEAST/GREATEST skip NULL in PostgreSQL,
+            #   requests without sender would collide per receiver
+            models.UniqueConstraint(Least('sender', 'receiver'), Greatest('sender', 'receiver'),
+                                    condition=models.Q(sender__isnull=False), name='unique_friend_request_pair'),
+        ]
+
 
 class ServerInvite(models.Model):
     CHOICES = (
@@ -211,6 +280,9 @@ class ServerInvite(models.Model):
         permissions = [
             ("send_invitation", "Can send invitations to private servers"),
         ]
+        indexes = [
+            models.Index(fields=['server', 'receiver']),
+        ]
     
     def __str__(self):
         return f'server: {self.server.name} receiver: {self.receiver.username}'
@@ -0,0 +1,41 @@
+from .events import group_send_on_commit
+from .protocol import frames
+
+
+def notification_group(user_id):
+    """Channel layer group of every notification socket of one user"""
+    return f'notifications_{user_id}'
+
+
+def push_notification(receiver_id, data):
+    """
+    Frame for receiver's sockets, "unread" is change of unread notifications count
+    so clients don't need to reload notification pages
+    """
+    group_send_on_commit(notification_group(receiver_id), {"type": "notification.push", **frames(data)})
+
+
+def notification_created(notification):
+    push_notification(notification.receiver_id, {
+        "notification": {
+            "id": str(notification.id),
+            "description": notification.description,
+            "date_created": notification.date_created.isoformat(),
+            "is_read": notification.is_read,
+        },
+        "unread": 0 if notification.is_read else 1,
+    })
+
+
+def notification_read_changed(notification):
+    push_notification(notification.receiver_id, {
+        "notification_read": {"id": str(notification.id), "is_read": notification.is_read},
+        "unread": -1 if notification.is_read else 1,
+    })
+
+
+def notification_deleted(notification):
+    push_notification(notification.receiver_id, {
+        "notification_deleted": str(notification.id),
+        "unread": 0 if notification.is_read else -1,
+    })
@@ -0,0 +1,98 @@
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def history_page_size(limit=None):
+    """Requested page size limited by VIPERCHAT_HISTORY_MAX_PAGE_SIZE"""
+    default = getattr(settings, 'VIPERCHAT_HISTORY_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'VIPERCHAT_HISTORY_MAX_PAGE_SIZE', 200)
+    try:
+        limit = int(limit) if limit is not None else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def encode_cursor(message):
+    return f'{message.date_created.isoformat()}_{message.id}'
+
+
+def decode_cursor(cursor):
+    """Returns (date_created, id) or None if cursor is malformed"""
+    try:
+        date, message_id = cursor.rsplit('_', 1)
+        date = parse_datetime(date)
+        message_id = uuid.UUID(message_id)
+    except (AttributeError, ValueError):
+        return None
+    if date is None:
+        return None
+    return date, message_id
+
+
+def keyset_page(queryset, cursor=None, limit=None):
+    """
+    Keyset pagination on (date_created, id), newest first. Page after cursor is found by index
+    seek, not by OFFSET, so cost doesn't grow with page number.
+    Returns page and cursor of older page (None if there is no more objects)
+    """
+    limit = history_page_size(limit)
+    queryset = queryset.order_by('-date_created', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        date, object_id = position
+        #   Range on date_created alone lets database seek in index, second filter breaks ties by id
+        queryset = queryset.filter(date_created__lte=date).filter(Q(date_created__lt=date) | Q(id__lt=object_id))
+    page = list(queryset[:limit + 1])
+    older_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return page[:limit], older_cursor
+
+
+def messages_before(queryset, cursor=None, limit=None):
+    """Same as keyset_page(), page in chronological order, for chat logs"""
+    page, older_cursor = keyset_page(queryset, cursor, limit)
+    page.reverse()
+    return page, older_cursor
+
+
+class KeysetPage:
+    """Stands in for Django's Page in templates, `page_obj.older_cursor` links older page"""
+    __slots__ = ('object_list', 'cursor', 'older_cursor')
+
+    def __init__(self, object_list, cursor, older_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.older_cursor = older_cursor
+
+    def has_older(self):
+        return self.older_cursor is not None
+
+    def is_first(self):
+        return not self.cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin replacing OFFSET pagination with keyset_page(). Newest objects first,
+    `?before=<cursor>` opens older page. Queryset model needs date_created and id.
+    """
+    cursor_param = 'before'
+    paginate_by = None
+
+    def get_paginate_by(self, queryset):
+        return history_page_size(self.paginate_by)
+
+    def paginate_queryset(self, queryset, page_size):
+        cursor = self.request.GET.get(self.cursor_param)
+        object_list, older_cursor = keyset_page(queryset, cursor, page_size)
+        page = KeysetPage(object_list, cursor, older_cursor)
+        return None, page, object_list, page.has_older() or not page.is_first()
@@ -0,0 +1,50 @@
+import threading
+
+from django.contrib.auth.models import Permission
+
+
+class PermissionRegistry:
+    """
+    Permission rows of viperchat models, loaded with one query the first time any is needed and kept
+    for the life of the process. Rows change only with migrations, post_migrate calls refresh()
+    (apps.py), next lookup loads them again.
+    """
+    def __init__(self):
+        self._permissions = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        permissions = {}
+        for permission in Permission.objects.filter(content_type__app_label='viperchat').select_related('content_type'):
+            permissions[(permission.codename, permission.content_type.model)] = permission
+            #   Codename alone finds first permission, codenames are not repeated across viperchat models
+            permissions.setdefault((permission.codename, None), permission)
+        return permissions
+
+    @property
+    def permissions(self):
+        permissions = self._permissions
+        if permissions is None:
+            with self._lock:
+                if self._permissions is None:
+                    self._permissions = self._load()
+                permissions = self._permissions
+        return permissions
+
+    def get(self, codename, model=None):
+        """Permission by codename and model it is defined on, raises Permission.DoesNotExist like objects.get()"""
+        key = (codename, model._meta.model_name if model is not None else None)
+        try:
+            return self.permissions[key]
+        except KeyError:
+            raise Permission.DoesNotExist(f'Permission {codename} does not exist') from None
+
+    def get_many(self, codenames):
+        return [self.get(codename) for codename in codenames]
+
+    def refresh(self, *args, **kwargs):
+        """Drops loaded rows, signature fits post_migrate receiver"""
+        self._permissions = None
+
+
+permission_registry = PermissionRegistry()
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .models import Message, Room
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat messages.
+    Consumers put unsaved Message instances on an async queue, one worker per process saves them
+    with a single bulk_create when batch size is reached or flush interval has passed.
+    Batch which fails is saved again message by message, only messages which can't be saved are dropped.
+    Every saved batch moves Room.last_sequence checkpoint of its rooms forward.
+    Settings:
+        VIPERCHAT_MESSAGE_WRITE_BEHIND - False saves every message before the consumer continues
+        VIPERCHAT_MESSAGE_BATCH_SIZE - max messages in one bulk_create
+        VIPERCHAT_MESSAGE_FLUSH_INTERVAL - max seconds message waits in queue
+    """
+    def __init__(self):
+        self._queue = None
+        self._loop = None
+        self._worker = None
+        #   Batch taken from queue and not saved yet
+        self._in_flight = []
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'VIPERCHAT_MESSAGE_WRITE_BEHIND', True)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'VIPERCHAT_MESSAGE_BATCH_SIZE', 100)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'VIPERCHAT_MESSAGE_FLUSH_INTERVAL', 0.05)
+
+    def _get_queue(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            #   Queue and worker belong to one event loop, move leftovers to the new one
+            leftovers = self._drain()
+            self._queue = asyncio.Queue()
+            self._loop = loop
+            self._worker = loop.create_task(self._run())
+            for message in leftovers:
+                self._queue.put_nowait(message)
+        return self._queue
+
+    def _drain(self):
+        messages = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                messages.append(self._queue.get_nowait())
+                self._queue.task_done()
+        return messages
+
+    async def _run(self):
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._in_flight = batch
+            try:
+                await save_messages(batch)
+            except Exception:
+                logger.exception('Saving %s chat messages failed', len(batch))
+            finally:
+                self._in_flight = []
+                for message in batch:
+                    queue.task_done()
+
+    async def save(self, message):
+        if not self.enabled:
+            await save_messages([message])
+        else:
+            self._get_queue().put_nowait(message)
+
+    async def flush(self):
+        """Wait until every queued message is saved"""
+        if self._queue is not None and self._loop is asyncio.get_running_loop():
+            await self._queue.join()
+
+    def flush_on_shutdown(self):
+        """
+        Save messages left in queue and batch being saved when process exits, event loop is not running
+        at this point. Messages of the batch which were saved meanwhile are dropped as duplicates.
+        """
+        messages = self._in_flight + self._drain()
+        self._in_flight = []
+        if messages:
+            save_batch(messages)
+
+
+def save_batch(messages):
+    """
+    bulk_create of whole batch, on failure every message is saved alone, so a message whose room,
+    chat or author was deleted while it waited in queue doesn't take other messages down with it
+    """
+    try:
+        saved = Message.objects.bulk_create(messages)
+    except DatabaseError:
+        logger.warning('Saving batch of %s chat messages failed, saving them one by one', len(messages))
+        saved = []
+        for message in messages:
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create([message])
+            except DatabaseError:
+                logger.exception('Dropping chat message %s which could not be saved', message.id)
+            else:
+                saved.append(message)
+    checkpoint_sequences(saved)
+    return saved
+
+
+def checkpoint_sequences(messages):
+    """
+    Highest saved sequence of every room, room sequence counter starts from it when it is missing
+    from cache (consumers.next_sequence). One update per room of batch.
+    """
+    last_sequences = {}
+    for message in messages:
+        if message.room_id is not None and message.sequence is not None:
+            last_sequences[message.room_id] = max(message.sequence, last_sequences.get(message.room_id, 0))
+    for room_id, sequence in last_sequences.items():
+        Room.objects.filter(pk=room_id, last_sequence__lt=sequence).update(last_sequence=sequence)
+
+
+save_messages = database_sync_to_async(save_batch)
+
+
+message_writer = MessageWriter()
@@ -0,0 +1,120 @@
+import asyncio
+
+from django.conf import settings
+
+from .protocol import frames
+
+
+class PresenceRecord:
+    """One online user in a room, user may have several sockets open"""
+    __slots__ = ('user_id', 'username', 'connections')
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+        self.connections = 0
+
+
+class RoomPresence:
+    """
+    Online users of one room, sockets listening to their changes and join/leave changes waiting for broadcast
+    """
+    __slots__ = ('records', 'listeners', 'joined', 'left', 'broadcast_scheduled')
+
+    def __init__(self):
+        self.records = {}
+        self.listeners = {}
+        self.joined = {}
+        self.left = {}
+        self.broadcast_scheduled = False
+
+
+class PresenceTracker:
+    """
+    Tracks who is online in rooms served by this process.
+    Changes are coalesced and broadcast at most once per VIPERCHAT_PRESENCE_BROADCAST_INTERVAL,
+    user who leaves and comes back within one interval produces no update at all.
+
+    Presence is per process: frames are handed to this process's sockets directly, never through
+    channel layer, and list only users connected to this process. With several workers users see
+    only room members routed to the same worker, but nobody is reported as left while still online.
+    """
+    def __init__(self):
+        self.rooms = {}
+        #   Event loop keeps only weak references to tasks
+        self.tasks = set()
+
+    @property
+    def broadcast_interval(self):
+        return getattr(settings, 'VIPERCHAT_PRESENCE_BROADCAST_INTERVAL', 1.0)
+
+    def online(self, room_id):
+        """Usernames of online users, no database query"""
+        room = self.rooms.get(room_id)
+        if room is None:
+            return []
+        return sorted(record.username for record in room.records.values())
+
+    def count(self, room_id):
+        room = self.rooms.get(room_id)
+        return len(room.records) if room else 0
+
+    def snapshot(self, room_id, group_name):
+        """Event with full online list, sent to socket when it joins"""
+        return {"type": "presence.update", "group": group_name,
+                **frames({"presence": {"online": self.online(room_id)}})}
+
+    def join(self, room_id, user, listener, group_name):
+        """
+        listener is presence_update handler of joining socket, it gets "presence.update" events
+        of room group_name
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomPresence()
+        room.listeners[listener] = group_name
+        record = room.records.get(user.pk)
+        if record is None:
+            record = room.records[user.pk] = PresenceRecord(user.pk, user.username)
+        record.connections += 1
+        if record.connections == 1:
+            if room.left.pop(user.pk, None) is None:
+                room.joined[user.pk] = user.username
+            self._schedule_broadcast(room_id, room)
+
+    def leave(self, room_id, user, listener):
+        room = self.rooms.get(room_id)
+        record = room.records.get(user.pk) if room else None
+        if record is None:
+            return
+        room.listeners.pop(listener, None)
+        record.connections -= 1
+        if record.connections == 0:
+            del room.records[user.pk]
+            if room.joined.pop(user.pk, None) is None:
+                room.left[user.pk] = user.username
+            self._schedule_broadcast(room_id, room)
+
+    def _schedule_broadcast(self, room_id, room):
+        if not room.broadcast_scheduled:
+            room.broadcast_scheduled = True
+            task = asyncio.get_running_loop().create_task(self._broadcast(room_id, room))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _broadcast(self, room_id, room):
+        await asyncio.sleep(self.broadcast_interval)
+        joined, left = sorted(room.joined.values()), sorted(room.left.values())
+        room.joined.clear()
+        room.left.clear()
+        room.broadcast_scheduled = False
+        if not room.records:
+            #   Nobody online from this process, room state can be dropped
+            self.rooms.pop(room_id, None)
+        if joined or left:
+            frame = frames({"presence": {"joined": joined, "left": left}})
+            for listener, group_name in list(room.listeners.items()):
+                await listener({"type": "presence.update", "group": group_name, **frame})
+
+
+presence = PresenceTracker()
@@ -0,0 +1,99 @@
+import json
+import time
+
+import msgpack
+
+
+#   Websocket subprotocol for binary clients, JSON text frames are used without it
+MSGPACK_SUBPROTOCOL = 'viperchat.msgpack'
+
+
+def encode(data, binary=False):
+    if binary:
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data)
+
+
+def decode(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data, raw=False)
+    return json.loads(text_data)
+
+
+def frames(data, binary_data=None):
+    """
+    Frame serialized for both kinds of clients, put into channel layer event by sender
+    """
+    return {
+        "text": json.dumps(data),
+        "bytes": msgpack.packb(data if binary_data is None else binary_data, use_bin_type=True),
+    }
+
+
+def chat_message_frames(author, content, sequence=None, timestamp=None, message_id=None):
+    """
+    JSON frame keeps "user: text" format, binary frame carries separate fields.
+    Message id lets clients apply later edits and deletions.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    text_data = {"message": f'{author.username}: {content}'}
+    binary_data = {
+        "message": {
+            "author_id": author.pk,
+            "author": author.username,
+            "content": content,
+            "timestamp": int(timestamp * 1000),     # milliseconds
+        }
+    }
+    if message_id is not None:
+        text_data["id"] = str(message_id)
+        binary_data["message"]["id"] = str(message_id)
+    if sequence is not None:
+        text_data["seq"] = sequence
+        binary_data["seq"] = sequence
+    return frames(text_data, binary_data)
+
+
+def message_edit_frames(message, deleted=False):
+    """Edited message with new content, or tombstone of deleted one"""
+    edit = {"id": str(message.id), "content": None if deleted else message.content, "deleted": deleted}
+    return frames(
+        {"edit": {**edit, "date_edited": message.date_edited.isoformat()}},
+        {"edit": {**edit, "date_edited": int(message.date_edited.timestamp() * 1000)}},
+    )
+
+
+def history_frame(messages, cursor, binary=False):
+    """Older messages page, `before` is cursor of next page or None"""
+    if binary:
+        page = [
+            {
+                "id": str(message.id),
+                "author_id": message.author_id,
+                "author": message.author.username,
+                "content": message.content,
+                "timestamp": int(message.date_created.timestamp() * 1000),
+                "seq": message.sequence,
+            } for message in messages
+        ]
+    else:
+        page = [
+            {
+                "id": str(message.id),
+                "author": message.author.username,
+                "content": message.content,
+                "date_created": message.date_created.isoformat(),
+            } for message in messages
+        ]
+    return encode({"history": {"messages": page, "before": cursor}}, binary)
+
+
+def stream_frame(stream, frame, binary=False):
+    """
+    Wraps pre-serialized frame into {"stream": stream, "frame": frame} of multiplexed connection,
+    frame itself is not decoded and encoded again
+    """
+    if binary:
+        return b'\x82' + msgpack.packb('stream') + msgpack.packb(stream) + msgpack.packb('frame') + frame["bytes"]
+    return f'{{"stream": {json.dumps(stream)}, "frame": {frame["text"]}}}'
@@ -0,0 +1,81 @@
+from bisect import bisect_left
+from collections import deque
+
+from django.conf import settings
+
+from .throttling import LRUStore
+
+
+class RoomReplay:
+    """Last sequence number seen in room and ring buffer of recent frames, sequences tell what ring holds"""
+    __slots__ = ('last_sequence', 'frames', 'sequences')
+
+    def __init__(self, last_sequence, size):
+        self.last_sequence = last_sequence
+        self.frames = deque(maxlen=size)
+        self.sequences = set()
+
+
+class ReplayBuffer:
+    """
+    Recent room frames kept by this process.
+    Reconnecting client sends last sequence it has seen and gets only missing frames,
+    VIPERCHAT_REPLAY_BUFFER_SIZE frames per room are kept in memory, for at most
+    VIPERCHAT_REPLAY_MAX_ROOMS recently used rooms.
+    Sequence numbers are not given here, every process shares one cache counter (consumers.next_sequence).
+    """
+    def __init__(self):
+        self.rooms = LRUStore(getattr(settings, 'VIPERCHAT_REPLAY_MAX_ROOMS', 1000))
+
+    @property
+    def size(self):
+        return getattr(settings, 'VIPERCHAT_REPLAY_BUFFER_SIZE', 500)
+
+    def seed(self, room_id, last_sequence):
+        """Frames after last_sequence will be remembered, older ones are in database"""
+        self.rooms.touch(room_id, lambda: RoomReplay(last_sequence, self.size))
+
+    def remember(self, room_id, sequence, frame):
+        """
+        Called by sender and by every recipient of frame in this process, frame already in ring
+        costs one set lookup
+        """
+        room = self.rooms.touch(room_id, lambda: RoomReplay(sequence - 1, self.size))
+        if sequence in room.sequences:
+            return
+        frames = room.frames
+        if not frames or sequence > frames[-1][0]:
+            if len(frames) == frames.maxlen:
+                room.sequences.discard(frames[0][0])
+            frames.append((sequence, frame))
+            room.sequences.add(sequence)
+        elif len(frames) == frames.maxlen and sequence < frames[0][0]:
+            #   Older than whole ring
+            return
+        else:
+            #   Frames of other processes may arrive out of order
+            sequences = [known for known, known_frame in frames]
+            position = bisect_left(sequences, sequence)
+            ordered = list(frames)
+            ordered.insert(position, (sequence, frame))
+            #   Full ring drops its oldest frame
+            room.frames = deque(ordered, maxlen=frames.maxlen)
+            room.sequences = {known for known, known_frame in room.frames}
+        room.last_sequence = max(room.last_sequence, sequence)
+
+    def since(self, room_id, last_sequence):
+        """
+        Frames after last_sequence, None if some of them are already gone from the ring
+        """
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        self.rooms.move_to_end(room_id)
+        if last_sequence >= room.last_sequence:
+            return []
+        if not room.frames or room.frames[0][0] > last_sequence + 1:
+            return None
+        return [frame for sequence, frame in room.frames if sequence > last_sequence]
+
+
+replay = ReplayBuffer()
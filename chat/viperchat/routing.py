@@ -4,4 +4,6 @@ from . import consumers
 websocket_urlpatterns = [
     path('ws/server/<uuid:server_id>/rooms/<uuid:pk>/', consumers.RoomChatConsumer.as_asgi()),
     path('ws/users-chat/<uuid:pk>/', consumers.UserChatConsumer.as_asgi()),
+    path('ws/chat/', consumers.MultiplexChatConsumer.as_asgi()),
+    path('ws/notifications/', consumers.NotificationConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,10 +1,13 @@
-from django.db.models.signals import post_save, pre_delete, post_delete
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import Group, Permission
 from django.contrib.auth import get_user
 
-from .models import UserPermissionSettings, ServerInvite, Notification, Message
+from .models import UserPermissionSettings, ServerInvite, Notification, Message, Server, ServerMembership
+from .notifications import notification_created, notification_read_changed, notification_deleted
+from .access import SERVER_ROLES, invalidate_server_permissions
+from .context_processor import invalidate_public_servers
 
 
 User = get_user_model()
@@ -40,3 +43,81 @@ def create_server_invite_answer_notifaction_post_delete(sender, instance, *args,
     elif instance.status == 'declined':
         description = f'{instance.receiver} has declined your invite to {instance.server} server'
         Notification.objects.create(description=description, receiver=instance.invitation_sender)
+
+
+@receiver(post_save, sender=Notification)
+def push_notification_post_save(sender, instance, created, *args, **kwargs):
+    """
+    Sends new notification or read status change to receiver's open sockets
+    """
+    if created:
+        notification_created(instance)
+    elif getattr(instance, 'saved_is_read', None) not in (None, instance.is_read):
+        notification_read_changed(instance)
+    instance.saved_is_read = instance.is_read
+
+
+@receiver(post_delete, sender=Notification)
+def push_notification_post_delete(sender, instance, *args, **kwargs):
+    notification_deleted(instance)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_server_permissions_group_permissions_changed(sender, instance, action, pk_set, *args, **kwargs):
+    """
+    Role group permissions changed, cached server permissions of group's server are outdated
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Group):
+        group_names = [instance.name]
+    elif pk_set is not None:
+        group_names = Group.objects.filter(pk__in=pk_set).values_list('name', flat=True)
+    else:
+        group_names = instance.group_set.values_list('name', flat=True)
+    server_names = {name.rsplit('_', 1)[0] for name in group_names if name.rsplit('_', 1)[-1] in SERVER_ROLES}
+    if server_names:
+        for server_id in Server.objects.filter(name__in=server_names).values_list('pk', flat=True):
+            invalidate_server_permissions(server_id)
+
+
+@receiver(m2m_changed, sender=Server.users.through)
+def invalidate_server_permissions_users_changed(sender, instance, action, pk_set, *args, **kwargs):
+    """
+    server.users.add()/remove() create and delete memberships without post_save
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if isinstance(instance, Server):
+        invalidate_server_permissions(instance.pk)
+    else:
+        for server_id in pk_set if pk_set is not None else instance.server_set.values_list('pk', flat=True):
+            invalidate_server_permissions(server_id)
+
+
+@receiver(post_save, sender=ServerMembership)
+@receiver(post_delete, sender=ServerMembership)
+def invalidate_server_permissions_membership_changed(sender, instance, *args, **kwargs):
+    invalidate_server_permissions(instance.server_id)
+
+
+@receiver(post_save, sender=Server)
+def rename_server_groups_post_save(sender, instance, created, *args, **kwargs):
+    """
+    Role groups are named after server, they follow server rename
+    """
+    saved_name = getattr(instance, 'saved_name', None)
+    if not created and saved_name not in (None, instance.name):
+        for role in SERVER_ROLES:
+            Group.objects.filter(name=f'{saved_name}_{role}').update(name=f'{instance.name}_{role}')
+        invalidate_server_permissions(instance.pk)
+    instance.saved_name = instance.name
+
+
+@receiver(post_save, sender=Server)
+@receiver(post_delete, sender=Server)
+def invalidate_public_servers_changed(sender, instance, *args, **kwargs):
+    """
+    Cached public servers list of context processor is outdated
+    """
+    invalidate_public_servers()
@@ -1,6 +1,7 @@
 from django import template
-from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.models import Group
 
+from viperchat.access import server_permissions as resolve_server_permissions
 from viperchat.utils import check_if_logged_user_can_delete_user, check_if_logged_user_can_change_users_group
 from viperchat.models import ServerInvite
 
@@ -16,26 +17,30 @@ def group_users(group):
     return group.user_set.all()
 
 
+@register.simple_tag
+def server_permissions(user, server):
+    return resolve_server_permissions(user, server)
+
+
 @register.simple_tag
 def check_if_logged_user_private_room_permission(logged_user, server):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    user_group = [group for group in server_groups if logged_user in group.user_set.all()]
-    permission = Permission.objects.get(codename='display_private_room_data')
-    if permission in user_group[0].permissions.all():
-        return True
-    else:
-        return False
+    return 'display_private_room_data' in resolve_server_permissions(logged_user, server)
 
 
 @register.simple_tag
 def user_group(user, server):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    user_group = [group for group in server_groups if user in group.user_set.all()]
-    return user_group[0].name.split("_")[-1]
+    member_actions = getattr(user, 'member_actions', None)
+    if member_actions is not None:
+        return member_actions.role
+    return resolve_server_permissions(user, server).role
 
 
 @register.simple_tag
 def check_if_logged_user_can_delete_another_user(logged_user, user_to_delete, server):
+    #   Precomputed for whole member list by utils.server_member_actions
+    member_actions = getattr(user_to_delete, 'member_actions', None)
+    if member_actions is not None:
+        return member_actions.can_delete
     if check_if_logged_user_can_delete_user(logged_user, user_to_delete, server) == True:
         return True
     else:
@@ -44,24 +49,19 @@ def check_if_logged_user_can_delete_another_user(logged_user, user_to_delete, se
 
 @register.simple_tag
 def check_if_logged_user_have_permission(logged_user, server, permission):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    user_group = [group for group in server_groups if logged_user in group.user_set.all()]
-    if permission in user_group[0].permissions.all():
-        return True
-    else:
-        return False
-
+    return permission.codename in resolve_server_permissions(logged_user, server)
 
 
 @register.simple_tag
 def user_group_all_data(user, server):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    user_group = [group for group in server_groups if user in group.user_set.all()]
-    return user_group[0]
+    return Group.objects.get(name=f'{server.name}_{resolve_server_permissions(user, server).role}')
 
 
 @register.simple_tag
 def check_if_logged_user_can_change_another_users_group(logged_user, user_to_change, server, destined_group):
+    member_actions = getattr(user_to_change, 'member_actions', None)
+    if member_actions is not None:
+        return destined_group.name[len(server.name) + 1:] in member_actions.assignable_roles
     if check_if_logged_user_can_change_users_group(logged_user, user_to_change, server, destined_group) == True:
         return True
     else:
@@ -70,13 +70,7 @@ def check_if_logged_user_can_change_another_users_group(logged_user, user_to_cha
 
 @register.simple_tag
 def check_if_logged_user_have_edit_room_permission(logged_user, server):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    user_group = [group for group in server_groups if logged_user in group.user_set.all()]
-    permission = Permission.objects.get(codename='edit_rooms_in_server')
-    if permission in user_group[0].permissions.all():
-        return True
-    else:
-        return False
+    return 'edit_rooms_in_server' in resolve_server_permissions(logged_user, server)
     
 
 @register.simple_tag
@@ -1,3 +1,474 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+from types import SimpleNamespace
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from .access import load_server_permissions
+from .consumers import next_sequence
+from .models import Chat, FriendRequest, Message, Room, Server, ServerPermissionSettings
+from .permission_registry import permission_registry
+from .permissions import remove_send_messages_in_server_permission
+from .persistence import save_batch
+from .presence import PresenceTracker
+from .replay import ReplayBuffer
+from .routing import websocket_urlpatterns
+from .throttling import shed_counters
+from .typing_indicators import TypingCoordinator
+from .utils import INITIAL_ROLE_PERMISSIONS, create_server_groups, initial_server_permissions
+
+
+User = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+#   Tests don't need Redis, shared cache of settings is replaced by cache of test process
+LOCAL_MEMORY_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_server(name, owner, members=()):
+    """Server with role groups of initial permissions, owner and members joined"""
+    server = Server.objects.create(
+        name=name, creator=owner, permission_settings=ServerPermissionSettings.objects.create()
+    )
+    initial_server_permissions(*create_server_groups(server))
+    server.users.add(owner, through_defaults={'role': 'owners'})
+    server.users.add(*members, through_defaults={'role': 'members'})
+    return server
+
+
+def communicator(path, user):
+    connection = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    connection.scope['user'] = user
+    return connection
+
+
+class CountingChannelLayer:
+    """Records group_send calls instead of delivering them"""
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((asyncio.get_running_loop().time(), json.loads(message["text"])))
+
+
+@override_settings(VIPERCHAT_TYPING_INTERVAL=0.05, VIPERCHAT_TYPING_MAX_USERS=5, VIPERCHAT_TYPING_TIMEOUT=10)
+class TypingIndicatorsLoadTest(SimpleTestCase):
+    """
+    Hundreds of users typing in one room must not produce more than one frame per interval
+    """
+    async def test_typing_frames_rate_is_bounded(self):
+        coordinator = TypingCoordinator()
+        channel_layer = CountingChannelLayer()
+        users = [SimpleNamespace(pk=number, username=f'user{number}') for number in range(300)]
+        loop = asyncio.get_running_loop()
+        duration = 0.5
+        events = 0
+        finish = loop.time() + duration
+        while loop.time() < finish:
+            for user in random.sample(users, 50):
+                if random.random() < 0.5:
+                    coordinator.start('room', user, channel_layer, 'chat_room')
+                else:
+                    coordinator.stop('room', user, channel_layer, 'chat_room')
+                events += 1
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.1)
+
+        sent_times = [sent_at for sent_at, frame in channel_layer.sent]
+        self.assertGreater(events, 1000)
+        self.assertGreater(len(sent_times), 0)
+        self.assertLessEqual(len(sent_times), (duration + 0.1) / 0.05 + 1)
+        for previous, following in zip(sent_times, sent_times[1:]):
+            self.assertGreaterEqual(following - previous, 0.05 - 0.005)
+        for sent_at, frame in channel_layer.sent:
+            self.assertLessEqual(len(frame["typing"]["users"]), 5)
+
+    async def test_typing_stop_is_broadcast(self):
+        coordinator = TypingCoordinator()
+        channel_layer = CountingChannelLayer()
+        user = SimpleNamespace(pk=1, username='user1')
+        coordinator.start('room', user, channel_layer, 'chat_room')
+        await asyncio.sleep(0.01)
+        coordinator.stop('room', user, channel_layer, 'chat_room')
+        await asyncio.sleep(0.15)
+        frames = [frame["typing"]["users"] for sent_at, frame in channel_layer.sent]
+        self.assertEqual(frames, [['user1'], []])
+        self.assertEqual(coordinator.rooms, {})
+
+
+@override_settings(VIPERCHAT_PRESENCE_BROADCAST_INTERVAL=0.05)
+class PresenceTrackerTest(SimpleTestCase):
+    """Changes are handed to sockets of this process, each gets events of its own group"""
+    async def test_changes_are_delivered_to_local_sockets(self):
+        tracker = PresenceTracker()
+        received = {'first': [], 'second': []}
+
+        def listener(name):
+            async def presence_update(event):
+                received[name].append((event["group"], json.loads(event["text"])))
+            return presence_update
+        first, second = listener('first'), listener('second')
+        alice, bob = SimpleNamespace(pk=1, username='alice'), SimpleNamespace(pk=2, username='bob')
+        tracker.join('room', alice, first, 'chat_room')
+        await asyncio.sleep(0.1)
+        snapshot = tracker.snapshot('room', 'stream_group')
+        self.assertEqual(json.loads(snapshot["text"]), {'presence': {'online': ['alice']}})
+        tracker.join('room', bob, second, 'stream_group')
+        await asyncio.sleep(0.1)
+        tracker.leave('room', alice, first)
+        await asyncio.sleep(0.1)
+        self.assertEqual(received['first'], [('chat_room', {'presence': {'joined': ['alice'], 'left': []}}),
+                                             ('chat_room', {'presence': {'joined': ['bob'], 'left': []}})])
+        self.assertEqual(received['second'], [('stream_group', {'presence': {'joined': ['bob'], 'left': []}}),
+                                              ('stream_group', {'presence': {'joined': [], 'left': ['alice']}})])
+        self.assertEqual(tracker.tasks, set())
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class ServerBootstrapQueriesTest(TestCase):
+    """
+    GiveInitialPermissions creates general room, four role groups and their permissions with a fixed number
+    of queries: session and user (2), server (1), room (1), groups (3), owner membership (2),
+    add() per group with its version invalidation (4 * 3) and savepoints (4). Permissions come from registry.
+    """
+    def test_bootstrap_query_budget(self):
+        user = User.objects.create_user(username='owner', password='password')
+        server = Server.objects.create(
+            name='bootstrap', creator=user, permission_settings=ServerPermissionSettings.objects.create()
+        )
+        server.users.add(user, through_defaults={'role': 'owners'})
+        self.client.force_login(user)
+        #   Registry is loaded once per process, its query is not part of the budget
+        permission_registry.get('send_invitation')
+        with self.assertNumQueries(25):
+            response = self.client.get(reverse('server_initial', kwargs={'pk': server.pk}))
+        self.assertRedirects(response, reverse('server_detail', kwargs={'pk': server.pk}), fetch_redirect_response=False)
+        self.assertTrue(Room.objects.filter(server=server, name='general').exists())
+        for role, codenames in INITIAL_ROLE_PERMISSIONS.items():
+            group = Group.objects.get(name=f'bootstrap_{role}')
+            self.assertEqual(set(group.permissions.values_list('codename', flat=True)), set(codenames))
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class ServerPermissionsQueryTest(TestCase):
+    def test_role_and_codenames_come_from_one_query(self):
+        owner = User.objects.create_user(username='owner', password='password')
+        member = User.objects.create_user(username='member', password='password')
+        stranger = User.objects.create_user(username='stranger', password='password')
+        server = create_server('single-query', owner, [member])
+        Group.objects.get(name='single-query_members').permissions.clear()
+        with self.assertNumQueries(1):
+            permissions = load_server_permissions(owner.pk, server)
+        self.assertEqual(permissions.role, 'owners')
+        self.assertEqual(permissions.codenames, set(INITIAL_ROLE_PERMISSIONS['owners']))
+        with self.assertNumQueries(1):
+            permissions = load_server_permissions(member.pk, server)
+        self.assertEqual((permissions.role, permissions.codenames), ('members', frozenset()))
+        with self.assertNumQueries(1):
+            self.assertFalse(load_server_permissions(stranger.pk, server).is_member)
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES, VIPERCHAT_HISTORY_PAGE_SIZE=3)
+class MessageKeysetPaginationTest(TestCase):
+    """Older pages are walked by cursor, messages sharing date_created are neither skipped nor repeated"""
+    def test_pages_cover_every_message_once(self):
+        user = User.objects.create_user(username='author', password='password')
+        server = Server.objects.create(
+            name='pages', creator=user, permission_settings=ServerPermissionSettings.objects.create()
+        )
+        server.users.add(user, through_defaults={'role': 'members'})
+        room = Room.objects.create(name='general', description='', server=server)
+        messages = Message.objects.bulk_create([
+            Message(room=room, author=user, content=str(number)) for number in range(8)
+        ])
+        Message.objects.filter(pk__in=[message.pk for message in messages[2:6]]).update(
+            date_created=messages[2].date_created
+        )
+        self.client.force_login(user)
+        url = reverse('user_messages_in_room', kwargs={'server_id': server.pk, 'pk': room.pk, 'username': 'author'})
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {'before': cursor} if cursor else {})
+            page = response.context['page_obj']
+            self.assertLessEqual(len(page), 3)
+            seen.extend(message.pk for message in page)
+            if not page.has_older():
+                break
+            cursor = page.older_cursor
+        self.assertEqual(len(seen), len(messages))
+        self.assertEqual(set(seen), {message.pk for message in messages})
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class FriendRequestPairTest(TestCase):
+    """One friend request per pair of users, whichever of them sent it"""
+    def test_mirrored_request_is_rejected(self):
+        sender = User.objects.create_user(username='sender', password='password')
+        receiver = User.objects.create_user(username='receiver', password='password')
+        self.client.force_login(sender)
+        response = self.client.get(reverse('friend_notification', kwargs={'username': 'receiver'}))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(receiver)
+        response = self.client.get(reverse('friend_notification', kwargs={'username': 'sender'}))
+        self.assertEqual(response.status_code, 403)
+        with self.assertRaises(IntegrityError):
+            FriendRequest.objects.create(sender=receiver, receiver=sender, description='')
+
+    def test_requests_without_sender_are_not_paired(self):
+        receiver = User.objects.create_user(username='receiver', password='password')
+        FriendRequest.objects.create(sender=None, receiver=receiver, description='')
+        FriendRequest.objects.create(sender=None, receiver=receiver, description='')
+        self.assertEqual(FriendRequest.objects.filter(receiver=receiver).count(), 2)
+
+
+@override_settings(VIPERCHAT_REPLAY_BUFFER_SIZE=3)
+class ReplayBufferTest(SimpleTestCase):
+    def test_out_of_order_frames_are_kept_in_order(self):
+        replay = ReplayBuffer()
+        replay.seed('room', 10)
+        for sequence in (11, 13, 12, 13):
+            replay.remember('room', sequence, sequence)
+        self.assertEqual(replay.since('room', 10), [11, 12, 13])
+        replay.remember('room', 14, 14)
+        self.assertIsNone(replay.since('room', 10))
+        self.assertEqual(replay.since('room', 11), [12, 13, 14])
+        replay.remember('room', 10, 10)
+        replay.remember('room', 12, 12)
+        self.assertEqual(replay.since('room', 11), [12, 13, 14])
+
+    def test_least_recently_used_rooms_are_dropped(self):
+        replay = ReplayBuffer()
+        replay.rooms.max_size = 2
+        for room in ('first', 'second', 'third'):
+            replay.remember(room, 1, room)
+        self.assertEqual(list(replay.rooms), ['second', 'third'])
+        self.assertIsNone(replay.since('first', 0))
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class RoomSequenceTest(TransactionTestCase):
+    """Every worker process numbers room messages from one cache counter, database keeps only a checkpoint"""
+    async def test_sequence_is_shared(self):
+        user = await User.objects.acreate(username='numbered')
+        server = await Server.objects.acreate(
+            name='numbers', creator=user, permission_settings=await ServerPermissionSettings.objects.acreate()
+        )
+        room = await Room.objects.acreate(name='general', server=server, last_sequence=10)
+        other_worker_room = await Room.objects.aget(pk=room.pk)
+        sequences = [await next_sequence(room), await next_sequence(other_worker_room), await next_sequence(room)]
+        self.assertEqual(sequences, [11, 12, 13])
+        self.assertEqual((await Room.objects.aget(pk=room.pk)).last_sequence, 10)
+
+        await database_sync_to_async(save_batch)([
+            Message(room=room, author=user, content=str(sequence), sequence=sequence) for sequence in sequences
+        ])
+        self.assertEqual((await Room.objects.aget(pk=room.pk)).last_sequence, 13)
+        #   Counter lost from cache continues after checkpoint
+        await cache.aclear()
+        self.assertEqual(await next_sequence(room), 14)
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MultiplexSubscribeTest(TransactionTestCase):
+    async def test_many_rooms_are_subscribed_without_rate_limit(self):
+        @database_sync_to_async
+        def setup():
+            owner = User.objects.create_user(username='subscriber', password='password')
+            server = create_server('many-rooms', owner)
+            return owner, Room.objects.bulk_create([
+                Room(name=f'room{number}', description='', server=server) for number in range(30)
+            ])
+        user, rooms = await setup()
+        connection = communicator('/ws/chat/', user)
+        connected, subprotocol = await connection.connect()
+        self.assertTrue(connected)
+        for room in rooms:
+            await connection.send_json_to({'type': 'subscribe', 'stream': f'room:{room.id}'})
+            self.assertEqual(await connection.receive_json_from(), {'subscribed': f'room:{room.id}'})
+            self.assertEqual((await connection.receive_json_from())['frame'], {'presence': {'online': ['subscriber']}})
+        await connection.send_json_to({'stream': f'room:{rooms[0].id}', 'message': 'first'})
+        self.assertEqual((await connection.receive_json_from())['frame']['message'], 'subscriber: first')
+        await connection.disconnect()
+
+    async def test_invalid_request_is_answered(self):
+        @database_sync_to_async
+        def setup():
+            user = User.objects.create_user(username='chatter', password='password')
+            chat = Chat.objects.create()
+            chat.participants.add(user)
+            return user, chat
+        user, chat = await setup()
+        connection = communicator('/ws/chat/', user)
+        await connection.connect()
+        stream = f'chat:{chat.id}'
+        await connection.send_json_to({'type': 'subscribe', 'stream': stream})
+        self.assertEqual(await connection.receive_json_from(), {'subscribed': stream})
+        for request in ({'type': 'resume', 'last_seq': 0}, {'type': 'unknown'}, {}):
+            await connection.send_json_to({'stream': stream, **request})
+            self.assertEqual(await connection.receive_json_from(), {'error': 'invalid_request', 'stream': stream})
+        await connection.send_json_to({'stream': stream, 'message': 'still open'})
+        self.assertEqual((await connection.receive_json_from())['frame']['message'], 'chatter: still open')
+        await connection.disconnect()
+
+    @override_settings(VIPERCHAT_RATE_LIMIT_SUBSCRIBE=(1, 2))
+    async def test_repeated_subscribe_is_rate_limited(self):
+        @database_sync_to_async
+        def setup():
+            user = User.objects.create_user(username='resubscriber', password='password')
+            chat = Chat.objects.create()
+            chat.participants.add(user)
+            return user, chat
+        user, chat = await setup()
+        connection = communicator('/ws/chat/', user)
+        await connection.connect()
+        stream = f'chat:{chat.id}'
+        for number in range(3):
+            await connection.send_json_to({'type': 'subscribe', 'stream': stream})
+        answers = [await connection.receive_json_from() for number in range(3)]
+        self.assertEqual(answers[:2], [{'subscribed': stream}] * 2)
+        self.assertEqual(answers[2]['error'], 'rate_limited')
+        await connection.disconnect()
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES)
+class MessageBatchTest(TransactionTestCase):
+    def test_bad_message_drops_only_itself(self):
+        user = User.objects.create_user(username='writer', password='password')
+        server = create_server('batch', user)
+        room = Room.objects.create(name='general', description='', server=server)
+        deleted_room = Room.objects.create(name='deleted', description='', server=server)
+        messages = [Message(room=room, author=user, content='first'),
+                    Message(room=deleted_room, author=user, content='lost'),
+                    Message(room=room, author=user, content='second')]
+        Room.objects.filter(pk=deleted_room.pk).delete()
+        with self.assertLogs('viperchat.persistence', 'WARNING'):
+            saved = save_batch(messages)
+        self.assertEqual([message.content for message in saved], ['first', 'second'])
+        self.assertEqual(set(Message.objects.values_list('content', flat=True)), {'first', 'second'})
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class RoomSocketAuthorizationTest(TransactionTestCase):
+    """Room socket is authorized at handshake, read-only members can't send"""
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.member = User.objects.create_user(username='member', password='password')
+        self.outsider = User.objects.create_user(username='outsider', password='password')
+        self.server = create_server('guarded', self.owner, [self.member])
+        self.room = Room.objects.create(name='general', description='', server=self.server)
+        self.private_room = Room.objects.create(name='private', description='', server=self.server, is_private=True)
+
+    def room_socket(self, room, user):
+        return communicator(f'/ws/server/{self.server.id}/rooms/{room.id}/', user)
+
+    async def member_socket(self):
+        connection = self.room_socket(self.room, self.member)
+        connected, subprotocol = await connection.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await connection.receive_json_from(), {'presence': {'online': ['member']}})
+        return connection
+
+    async def assert_rejected(self, room, user):
+        connected, code = await self.room_socket(room, user).connect()
+        self.assertFalse(connected)
+
+    async def test_anonymous_user_is_rejected(self):
+        await self.assert_rejected(self.room, AnonymousUser())
+
+    async def test_non_member_is_rejected(self):
+        await self.assert_rejected(self.room, self.outsider)
+
+    async def test_private_room_needs_display_private_room_data(self):
+        await self.assert_rejected(self.private_room, self.member)
+        members = await Group.objects.aget(name='guarded_members')
+        await database_sync_to_async(members.permissions.add)(permission_registry.get('display_private_room_data'))
+        connection = self.room_socket(self.private_room, self.member)
+        connected, subprotocol = await connection.connect()
+        self.assertTrue(connected)
+        await connection.disconnect()
+
+    async def test_read_only_member_gets_forbidden(self):
+        await database_sync_to_async(remove_send_messages_in_server_permission)(
+            await Group.objects.aget(name='guarded_members')
+        )
+        connection = await self.member_socket()
+        await connection.send_json_to({'message': 'hello'})
+        self.assertEqual(await connection.receive_json_from(), {'error': 'forbidden'})
+        await connection.disconnect()
+        self.assertFalse(await Message.objects.filter(room=self.room).aexists())
+
+    @override_settings(VIPERCHAT_RATE_LIMIT_CONNECTION=(1, 3), VIPERCHAT_RATE_LIMIT_LOG_INTERVAL=60)
+    async def test_forbidden_frames_are_rate_limited(self):
+        await database_sync_to_async(remove_send_messages_in_server_permission)(
+            await Group.objects.aget(name='guarded_members')
+        )
+        connection = await self.member_socket()
+        shed_counters.logged_at = None
+        with self.assertLogs('viperchat.throttling', 'WARNING'):
+            for number in range(5):
+                await connection.send_json_to({'message': 'hello'})
+            errors = [(await connection.receive_json_from())['error'] for number in range(5)]
+        self.assertEqual(errors, ['forbidden'] * 3 + ['rate_limited'] * 2)
+        await connection.disconnect()
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AccessRevocationTest(TransactionTestCase):
+    """Views changing membership or role permissions update live room sockets after commit"""
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password')
+        self.member = User.objects.create_user(username='member', password='password')
+        self.server = create_server('revoked', self.owner, [self.member])
+        self.room = Room.objects.create(name='general', description='', server=self.server)
+        self.client.force_login(self.owner)
+
+    async def member_socket(self):
+        connection = communicator(f'/ws/server/{self.server.id}/rooms/{self.room.id}/', self.member)
+        connected, subprotocol = await connection.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await connection.receive_json_from(), {'presence': {'online': ['member']}})
+        return connection
+
+    async def assert_sending_forbidden(self, connection):
+        #   Access change event is handled before next frame
+        self.assertTrue(await connection.receive_nothing(0.1))
+        await connection.send_json_to({'message': 'hello'})
+        self.assertEqual(await connection.receive_json_from(), {'error': 'forbidden'})
+        await connection.disconnect()
+
+    async def test_deleted_user_socket_is_closed(self):
+        connection = await self.member_socket()
+        await database_sync_to_async(self.client.get)(reverse(
+            'delete_user_from_server', kwargs={'server_id': self.server.id, 'username': 'member'}
+        ))
+        self.assertEqual(await connection.receive_output(), {'type': 'websocket.close', 'code': 4003})
+
+    async def test_group_change_downgrades_sending(self):
+        moderators = await Group.objects.aget(name='revoked_moderators')
+        await database_sync_to_async(remove_send_messages_in_server_permission)(moderators)
+        connection = await self.member_socket()
+        await database_sync_to_async(self.client.get)(reverse(
+            'user_group_edit', kwargs={'server_id': self.server.id, 'username': 'member', 'name': 'revoked_moderators'}
+        ))
+        await self.assert_sending_forbidden(connection)
+
+    async def test_permission_change_downgrades_sending(self):
+        connection = await self.member_socket()
+
+        @database_sync_to_async
+        def forbid_members_sending():
+            permission_settings = self.server.permission_settings
+            permission_settings.members_send_messages = 'Forbidden'
+            permission_settings.save()
+            self.client.get(reverse('permissions_change', kwargs={'pk': self.server.id}))
+        await forbid_members_sending()
+        await self.assert_sending_forbidden(connection)
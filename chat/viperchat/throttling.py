@@ -0,0 +1,151 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+
+#   Websocket close code used when client keeps sending over the limit
+RATE_LIMIT_CLOSE_CODE = 4029
+
+logger = logging.getLogger(__name__)
+
+
+class ShedCounters(Counter):
+    """
+    How much traffic was shed in this process. Totals are logged when traffic is shed,
+    at most once per VIPERCHAT_RATE_LIMIT_LOG_INTERVAL seconds.
+    """
+    def __init__(self):
+        super().__init__()
+        self.logged_at = None
+
+    def add(self, name):
+        self[name] += 1
+        now = time.monotonic()
+        interval = getattr(settings, 'VIPERCHAT_RATE_LIMIT_LOG_INTERVAL', 60)
+        if self.logged_at is None or now - self.logged_at >= interval:
+            self.logged_at = now
+            logger.warning('Websocket traffic shed by rate limits so far: %s', dict(self))
+
+
+shed_counters = ShedCounters()
+
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `capacity`, every frame costs one token
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        return round((1 - self.tokens) / self.rate, 2)
+
+
+class LRUStore(OrderedDict):
+    """Keeps only recently used entries so state of long gone users doesn't pile up"""
+    def __init__(self, max_size):
+        super().__init__()
+        self.max_size = max_size
+
+    def touch(self, key, default_factory):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        value = self[key] = default_factory()
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+        return value
+
+
+#   Buckets shared by all user connections in this process
+user_buckets = LRUStore(10000)
+#   Last message time per (room, user) for rooms with slow mode
+slow_mode_last_sent = LRUStore(10000)
+
+
+class ConnectionThrottle:
+    """
+    Per-connection limiter, also charges user bucket and room slow mode.
+    Settings:
+        VIPERCHAT_RATE_LIMIT_CONNECTION - (messages per second, burst) for one socket
+        VIPERCHAT_RATE_LIMIT_USER - (messages per second, burst) for all sockets of one user
+        VIPERCHAT_RATE_LIMIT_SUBSCRIBE - (subscriptions per second, burst) for one multiplexed socket,
+            burst should let client open VIPERCHAT_MULTIPLEX_MAX_STREAMS streams at once
+        VIPERCHAT_RATE_LIMIT_MAX_STRIKES - over limit frames in a row before socket is closed
+    """
+    def __init__(self, user_id):
+        rate, burst = getattr(settings, 'VIPERCHAT_RATE_LIMIT_CONNECTION', (5, 10))
+        self.user_id = user_id
+        self.bucket = TokenBucket(rate, burst)
+        rate, burst = getattr(settings, 'VIPERCHAT_RATE_LIMIT_SUBSCRIBE',
+                              (5, getattr(settings, 'VIPERCHAT_MULTIPLEX_MAX_STREAMS', 50)))
+        self.subscribe_bucket = TokenBucket(rate, burst)
+        self.max_strikes = getattr(settings, 'VIPERCHAT_RATE_LIMIT_MAX_STRIKES', 20)
+        self.strikes = 0
+        self.closed = False
+
+    def check(self):
+        """
+        Every frame is checked, returns None if frame is allowed, otherwise (reason, retry_after)
+        """
+        return self._record(self._check(time.monotonic()))
+
+    def check_slow_mode(self, room):
+        """Messages are checked again against room slow mode"""
+        result = None
+        if self.user_id is not None and room.slow_mode:
+            now = time.monotonic()
+            key = (room.id, self.user_id)
+            last_sent = slow_mode_last_sent.get(key)
+            if last_sent is not None and now - last_sent < room.slow_mode:
+                result = ('slow_mode', round(room.slow_mode - (now - last_sent), 2))
+            else:
+                slow_mode_last_sent.touch(key, lambda: now)
+                slow_mode_last_sent[key] = now
+        return self._record(result)
+
+    def check_subscribe(self):
+        """Subscriptions have own bucket, user's message bucket is not charged"""
+        if self.subscribe_bucket.consume(time.monotonic()):
+            result = None
+        else:
+            result = ('rate_limited', self.subscribe_bucket.retry_after())
+        return self._record(result)
+
+    def _record(self, result):
+        if result is None:
+            self.strikes = 0
+        else:
+            self.strikes += 1
+            shed_counters.add(f'frames_{result[0]}')
+        return result
+
+    def _check(self, now):
+        if not self.bucket.consume(now):
+            return ('rate_limited', self.bucket.retry_after())
+        if self.user_id is not None:
+            rate, burst = getattr(settings, 'VIPERCHAT_RATE_LIMIT_USER', (10, 20))
+            user_bucket = user_buckets.touch(self.user_id, lambda: TokenBucket(rate, burst))
+            if not user_bucket.consume(now):
+                return ('rate_limited', user_bucket.retry_after())
+        return None
+
+    @property
+    def exceeded(self):
+        """Client ignores error frames, socket should be closed"""
+        return self.strikes > self.max_strikes
@@ -0,0 +1,109 @@
+import asyncio
+
+from django.conf import settings
+
+from .protocol import frames
+
+
+class RoomTyping:
+    """Users typing in one room or chat and state of last broadcast"""
+    __slots__ = ('typing', 'broadcast_handle', 'broadcast_at', 'last_sent_at', 'last_frame')
+
+    def __init__(self):
+        self.typing = {}
+        self.broadcast_handle = None
+        self.broadcast_at = None
+        self.last_sent_at = 0
+        self.last_frame = None
+
+
+class TypingCoordinator:
+    """
+    Coalesces typing start/stop events of a room into one "users typing" frame.
+    At most one frame per VIPERCHAT_TYPING_INTERVAL is sent to room group no matter how many
+    users type, frame lists up to VIPERCHAT_TYPING_MAX_USERS usernames.
+    Typing expires after VIPERCHAT_TYPING_TIMEOUT seconds without start event.
+    Rooms with more than VIPERCHAT_TYPING_MAX_FANOUT online users get no typing frames at all.
+    State of room is dropped when nobody has typed there for an interval.
+    """
+    def __init__(self):
+        self.rooms = {}
+        #   Event loop keeps only weak references to tasks
+        self.tasks = set()
+
+    @property
+    def interval(self):
+        return getattr(settings, 'VIPERCHAT_TYPING_INTERVAL', 1.0)
+
+    @property
+    def max_users(self):
+        return getattr(settings, 'VIPERCHAT_TYPING_MAX_USERS', 5)
+
+    @property
+    def max_fanout(self):
+        return getattr(settings, 'VIPERCHAT_TYPING_MAX_FANOUT', 200)
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'VIPERCHAT_TYPING_TIMEOUT', 6.0)
+
+    def start(self, room_key, user, channel_layer, group_name):
+        room = self.rooms.get(room_key)
+        if room is None:
+            room = self.rooms[room_key] = RoomTyping()
+        loop = asyncio.get_running_loop()
+        is_new = user.pk not in room.typing
+        room.typing[user.pk] = (user.username, loop.time() + self.timeout)
+        if is_new:
+            self._schedule_broadcast(room_key, room, channel_layer, group_name, loop.time())
+
+    def stop(self, room_key, user, channel_layer, group_name):
+        room = self.rooms.get(room_key)
+        if room is not None and room.typing.pop(user.pk, None) is not None:
+            self._schedule_broadcast(room_key, room, channel_layer, group_name, asyncio.get_running_loop().time())
+
+    def _schedule_broadcast(self, room_key, room, channel_layer, group_name, when):
+        """Broadcast at `when` but not earlier than interval after previous one"""
+        when = max(when, room.last_sent_at + self.interval)
+        if room.broadcast_handle is not None:
+            if room.broadcast_at <= when:
+                return
+            room.broadcast_handle.cancel()
+        loop = asyncio.get_running_loop()
+        room.broadcast_at = when
+        room.broadcast_handle = loop.call_at(when, self._start_broadcast, room_key, room, channel_layer, group_name)
+
+    def _start_broadcast(self, room_key, room, channel_layer, group_name):
+        task = asyncio.get_running_loop().create_task(self._broadcast(room_key, room, channel_layer, group_name))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _broadcast(self, room_key, room, channel_layer, group_name):
+        room.broadcast_handle = None
+        now = asyncio.get_running_loop().time()
+        for user_id, (username, expires_at) in list(room.typing.items()):
+            if expires_at <= now:
+                del room.typing[user_id]
+        usernames = sorted(username for username, expires_at in room.typing.values())
+        frame = frames({"typing": {
+            "users": usernames[:self.max_users],
+            "others": max(0, len(usernames) - self.max_users),
+        }})
+        if frame != room.last_frame:
+            room.last_frame = frame
+            room.last_sent_at = now
+            await channel_layer.group_send(group_name, {"type": "typing.update", "group": group_name, **frame})
+        if room.typing:
+            #   Check again when first typing entry expires
+            next_expiry = min(expires_at for username, expires_at in room.typing.values())
+            self._schedule_broadcast(room_key, room, channel_layer, group_name, next_expiry)
+        else:
+            #   Kept until interval after last frame passes, so new typing can't be broadcast sooner
+            asyncio.get_running_loop().call_at(room.last_sent_at + self.interval, self._prune, room_key, room)
+
+    def _prune(self, room_key, room):
+        if not room.typing and room.broadcast_handle is None and self.rooms.get(room_key) is room:
+            del self.rooms[room_key]
+
+
+typing_coordinator = TypingCoordinator()
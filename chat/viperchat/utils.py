@@ -1,230 +1,218 @@
-from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.models import Group
+from django.db.models import Q
 from django.forms.models import model_to_dict
-from django.urls import reverse
-from django.shortcuts import redirect
 
-from .models import Server
-from .permissions import *
+from .permission_registry import permission_registry
+from .access import SERVER_ROLES, server_group_names, server_permissions, invalidate_server_permissions, \
+    prime_server_permissions
+
+
+#   Default permissions of server role groups
+INITIAL_ROLE_PERMISSIONS = {
+    'owners': (
+        'delete_message_from_server', 'send_invitation', 'create_room_in_server', 'send_messages_in_server',
+        'delete_masters_from_server', 'delete_moderators_from_server', 'delete_members_from_server',
+        'edit_permissions_in_server', 'delete_user_from_server', 'edit_masters_group', 'edit_moderators_group',
+        'edit_members_group', 'change_user_group', 'edit_rooms_in_server',
+    ),
+    'masters': (
+        'delete_message_from_server', 'send_invitation', 'send_messages_in_server', 'delete_moderators_from_server',
+        'delete_members_from_server', 'delete_user_from_server', 'edit_rooms_in_server',
+    ),
+    'moderators': (
+        'delete_message_from_server', 'send_invitation', 'send_messages_in_server', 'delete_members_from_server',
+        'delete_user_from_server',
+    ),
+    'members': (
+        'send_messages_in_server', 'send_invitation',
+    ),
+}
+
+
+def create_server_groups(server):
+    """Role groups of server, missing ones are created in one bulk insert"""
+    names = server_group_names(server)
+    existing = set(Group.objects.filter(name__in=names).values_list('name', flat=True))
+    Group.objects.bulk_create([Group(name=name) for name in names if name not in existing])
+    groups = {group.name: group for group in Group.objects.filter(name__in=names)}
+    return [groups[name] for name in names]
 
 
 def initial_server_permissions(owners, masters, moderators, members):
-    """Set initial permissions for groups in server"""
-    #   Owners permissions
-    add_delete_message_permission(owners)
-    add_send_invitation_permission(owners)
-    add_create_room_in_server_permission(owners)
-    add_send_messages_in_server_permission(owners)
-    add_delete_masters_from_server_permission(owners)
-    add_delete_moderators_from_server_permission(owners)
-    add_delete_members_from_server_permission(owners)
-    add_edit_permissions_in_server(owners)
-    add_delete_user_from_server_permission(owners)
-    add_edit_masters_group(owners)
-    add_edit_moderators_group(owners)
-    add_edit_members_group(owners)
-    add_edit_users_group(owners)
-    add_edit_rooms_in_server(owners)
-    #   Masters permissions
-    add_delete_message_permission(masters)
-    add_send_invitation_permission(masters)
-    add_send_messages_in_server_permission(masters)
-    add_delete_moderators_from_server_permission(masters)
-    add_delete_members_from_server_permission(masters)
-    add_delete_user_from_server_permission(masters)
-    add_edit_rooms_in_server(masters)
-    #   Moderators permissions
-    add_delete_message_permission(moderators)
-    add_send_invitation_permission(moderators)
-    add_send_messages_in_server_permission(moderators)
-    add_delete_members_from_server_permission(moderators)
-    add_delete_user_from_server_permission(moderators)
-    #   Members permissions
-    add_send_messages_in_server_permission(members)
-    add_send_invitation_permission(members)
+    """Set initial permissions for groups in server, one add() per group, permissions come from registry"""
+    for role, group in zip(SERVER_ROLES, (owners, masters, moderators, members)):
+        group.permissions.add(*permission_registry.get_many(INITIAL_ROLE_PERMISSIONS[role]))
+
+
+#   Permission sets telling which tier of delete/change rules logged user is in
+OWNERS_DELETE_PERMISSIONS = frozenset(('delete_masters_from_server', 'delete_moderators_from_server',
+                                       'delete_members_from_server'))
+MASTERS_DELETE_PERMISSIONS = frozenset(('delete_moderators_from_server', 'delete_members_from_server'))
+MODERATORS_DELETE_PERMISSIONS = frozenset(('delete_members_from_server',))
+OWNERS_CHANGE_PERMISSIONS = frozenset(('edit_moderators_group', 'edit_members_group', 'edit_masters_group'))
+MASTERS_CHANGE_PERMISSIONS = frozenset(('edit_moderators_group', 'edit_members_group'))
+
+
+def deletable_roles(codenames, permission_settings):
+    """
+    Roles of users that user with given permission codenames may delete from server.
+    Pure function of permission snapshot, None stands for user without role.
+    """
+    if OWNERS_DELETE_PERMISSIONS <= codenames:
+        return frozenset(('masters', 'moderators', 'members', None))
+    if MASTERS_DELETE_PERMISSIONS <= codenames:
+        #   Check if masters have permission to delete user
+        if permission_settings.masters_delete_user == 'Forbidden':
+            return frozenset()
+        return frozenset(('moderators', 'members', None))
+    if MODERATORS_DELETE_PERMISSIONS <= codenames:
+        #   Check if moderators have permission to delete user
+        if permission_settings.moderators_delete_user == 'Allowed':
+            return frozenset(('members',))
+    return frozenset()
+
+
+def group_change_roles(role, codenames, permission_settings):
+    """
+    Roles of users whose group user with given role and codenames may change, and roles they may be moved to.
+    Pure function of permission snapshot, owners are never changed.
+    """
+    #   masters have no permission to promote to masters or owners
+    destined_roles = frozenset(('moderators', 'members')) if role == 'masters' else frozenset(SERVER_ROLES)
+    if OWNERS_CHANGE_PERMISSIONS <= codenames:
+        return frozenset(('masters', 'moderators', 'members', None)), destined_roles
+    if MASTERS_CHANGE_PERMISSIONS <= codenames and permission_settings.masters_can_edit_users_group != 'Forbidden':
+        return frozenset(('moderators', 'members', None)), destined_roles
+    return frozenset(), destined_roles
+
+
+def can_delete_member(permissions, target_role, permission_settings):
+    return target_role in deletable_roles(permissions.codenames, permission_settings)
+
+
+def can_change_member_group(permissions, target_role, destined_role, permission_settings):
+    changeable_roles, destined_roles = group_change_roles(permissions.role, permissions.codenames, permission_settings)
+    return target_role in changeable_roles and destined_role in destined_roles
+
+
+def deletable_members(permissions, target_roles, permission_settings):
+    """can_delete_member for list of target roles, rule is evaluated once"""
+    roles = deletable_roles(permissions.codenames, permission_settings)
+    return [target_role in roles for target_role in target_roles]
+
+
+def assignable_member_roles(permissions, target_roles, permission_settings):
+    """Roles every target may be moved to, empty when target's group can't be changed"""
+    changeable_roles, destined_roles = group_change_roles(permissions.role, permissions.codenames, permission_settings)
+    nothing = frozenset()
+    return [destined_roles if target_role in changeable_roles else nothing for target_role in target_roles]
 
 
 def check_if_logged_user_can_delete_user(logged_user, user_to_delete, server):
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    permission_settings = server.permission_settings
-    owners_group = Group.objects.get(name=f'{server.name}_owners')
-    masters_group = Group.objects.get(name=f'{server.name}_masters')
-    members_group = Group.objects.get(name=f'{server.name}_members')
-
-    owners_delete_permissions = [
-        Permission.objects.get(codename='delete_masters_from_server'),
-        Permission.objects.get(codename='delete_moderators_from_server'),
-        Permission.objects.get(codename='delete_members_from_server')
-    ]
-
-    masters_delete_permissions = [
-        Permission.objects.get(codename='delete_moderators_from_server'),
-        Permission.objects.get(codename='delete_members_from_server')
-    ]
-
-    moderator_delete_permissions = [
-        Permission.objects.get(codename='delete_members_from_server')
-    ]
-    
-    for group in server_groups:
-        if user_to_delete in owners_group.user_set.all():
-            return False
-        #   Owners group
-        if logged_user in group.user_set.all() and \
-        all(permission in group.permissions.all() for permission in owners_delete_permissions): 
-            if user_to_delete in owners_group.user_set.all():   #   Delete owners is prohibited
-                return False
-            else:
-                return True
-        #   Masters group
-        if logged_user in group.user_set.all() and \
-        all(permission in group.permissions.all() for permission in masters_delete_permissions): 
-            #   Check if masters have permission to delete user
-            if permission_settings.masters_delete_user == 'Forbidden' or \
-            user_to_delete in owners_group.user_set.all() or \
-            user_to_delete in masters_group.user_set.all():
-                return False
-            else:
-                return True
-        #   Moderators group
-        if logged_user in group.user_set.all()  \
-        and all(permission in group.permissions.all() for permission in moderator_delete_permissions):
-            #   Check if moderators have permission to delete user
-            if user_to_delete in members_group.user_set.all() and permission_settings.moderators_delete_user == 'Allowed':
-                return True
-            else:
-                return False
+    return can_delete_member(server_permissions(logged_user, server), server_permissions(user_to_delete, server).role,
+                             server.permission_settings)
             
 
-def set_masters_permissions(server_model_instance):
-    permission_settings = server_model_instance.permission_settings
-    masters_group = Group.objects.get(name=f'{server_model_instance.name}_masters')
-    #   masters permission settings from model
-    masters_settings = {permission: value for permission, value in model_to_dict(permission_settings).items() 
-                        if permission.startswith('masters_')}
-    
-    #   set masters group permissions
-    for permission, value in masters_settings.items():
-        if permission == 'masters_create_room':
-            set_permission(value, masters_group, add_create_room_in_server_permission, remove_create_room_in_server_permission)
-        if permission == 'masters_send_invitation_to_server':
-            set_permission(value, masters_group, add_send_invitation_permission, remove_send_invitation_permission)
-        if permission == 'masters_delete_user':
-            set_permission(value, masters_group, add_delete_user_from_server_permission, remove_delete_user_from_server_permission)
-            set_permission(value, masters_group, add_delete_moderators_from_server_permission, remove_delete_moderators_from_server_permission)
-            set_permission(value, masters_group, add_delete_members_from_server_permission, remove_delete_members_from_server_permission)
-        if permission == 'masters_delete_messages':
-            set_permission(value, masters_group, add_delete_message_permission, remove_delete_message_permission)
-        if permission == 'masters_send_messages':
-            set_permission(value, masters_group, add_send_messages_in_server_permission, remove_send_messages_in_server_permission)
-        if permission == 'masters_can_see_private_rooms':
-            set_permission(value, masters_group, add_display_room_data_permission, remove_display_room_data_permission)
-        if permission == 'masters_can_edit_users_group':
-            set_permission(value, masters_group, add_edit_users_group, remove_edit_users_group)
-            set_permission(value, masters_group, add_edit_moderators_group, remove_edit_moderators_group)
-            set_permission(value, masters_group, add_edit_members_group, remove_edit_members_group)
-        if permission == 'masters_can_edit_rooms':
-            set_permission(value, masters_group, add_edit_rooms_in_server, remove_edit_rooms_in_server)
-    masters_group.save()
-    return "Permissions changed successfully"
-
-
-def set_moderators_permissions(server_model_instance):
-    permission_settings = server_model_instance.permission_settings
-    moderators_group = Group.objects.get(name=f'{server_model_instance.name}_moderators')
-    #   moderator permission settings from model
-    moderators_settings = {permission: value for permission, value in model_to_dict(permission_settings).items() 
-                        if permission.startswith('moderators_')}
-    #   set moderators group permissions
-    for permission, value in moderators_settings.items():
-        if permission == 'moderators_create_room':
-            set_permission(value, moderators_group, add_create_room_in_server_permission, remove_create_room_in_server_permission)
-        if permission == 'moderators_send_invitation_to_server':
-            set_permission(value, moderators_group, add_send_invitation_permission, remove_send_invitation_permission)
-        if permission == 'moderators_delete_user':
-            set_permission(value, moderators_group, add_delete_user_from_server_permission, remove_delete_user_from_server_permission)
-            set_permission(value, moderators_group, add_delete_members_from_server_permission, remove_delete_members_from_server_permission)
-        if permission == 'moderators_delete_messages':
-            set_permission(value, moderators_group, add_delete_message_permission, remove_delete_message_permission)
-        if permission == 'moderators_send_messages':
-            set_permission(value, moderators_group, add_send_messages_in_server_permission, remove_send_messages_in_server_permission)
-        if permission == 'moderators_can_see_private_rooms':
-            set_permission(value, moderators_group, add_display_room_data_permission, remove_display_room_data_permission)
-        if permission == 'moderators_can_edit_rooms':
-            set_permission(value, moderators_group, add_edit_rooms_in_server, remove_edit_rooms_in_server)
-    moderators_group.save()
-    return "Permissions changed successfully"
-
-
-def set_members_permissions(server_model_instance):
-    members_group = Group.objects.get(name=f'{server_model_instance.name}_members')
-    permission_settings = server_model_instance.permission_settings
-     #   members permission settings from model
-    members_settings = {permission: value for permission, value in model_to_dict(permission_settings).items()
-                        if permission.startswith('members_')}
-    # #   set members group permissions
-    for permission, value in members_settings.items():
-        if permission == 'members_create_room':
-            set_permission(value, members_group, add_create_room_in_server_permission, remove_create_room_in_server_permission)
-        if permission == 'members_send_invitation_to_server':
-            set_permission(value, members_group, add_send_invitation_permission, remove_send_invitation_permission)
-        if permission == 'members_delete_messages':
-            set_permission(value, members_group, add_delete_message_permission, remove_delete_message_permission)
-        if permission == 'members_send_messages':
-            set_permission(value, members_group, add_send_messages_in_server_permission, remove_send_messages_in_server_permission)
-        if permission == 'members_can_see_private_rooms':
-            set_permission(value, members_group, add_display_room_data_permission, remove_display_room_data_permission)
-    members_group.save()
-    return "Permissions changed successfully"
-    
-
-def set_permission(permission_settings_object, group, add_permission_function, remove_permission_function):
-    if permission_settings_object == 'Allowed':
-        add_permission_function(group)
-        group.save()
-    elif permission_settings_object == 'Forbidden':
-        remove_permission_function(group)
-        group.save()
+#   Permissions switched by every ServerPermissionSettings field
+PERMISSION_SETTINGS_CODENAMES = {
+    #   Masters permissions
+    'masters_create_room': ('create_room_in_server',),
+    'masters_send_invitation_to_server': ('send_invitation',),
+    'masters_delete_user': ('delete_user_from_server', 'delete_moderators_from_server', 'delete_members_from_server'),
+    'masters_delete_messages': ('delete_message_from_server',),
+    'masters_send_messages': ('send_messages_in_server',),
+    'masters_can_see_private_rooms': ('display_private_room_data',),
+    'masters_can_edit_users_group': ('change_user_group', 'edit_moderators_group', 'edit_members_group'),
+    'masters_can_edit_rooms': ('edit_rooms_in_server',),
+    #   Moderators permissions
+    'moderators_create_room': ('create_room_in_server',),
+    'moderators_send_invitation_to_server': ('send_invitation',),
+    'moderators_delete_user': ('delete_user_from_server', 'delete_members_from_server'),
+    'moderators_delete_messages': ('delete_message_from_server',),
+    'moderators_send_messages': ('send_messages_in_server',),
+    'moderators_can_see_private_rooms': ('display_private_room_data',),
+    'moderators_can_edit_rooms': ('edit_rooms_in_server',),
+    #   Members permissions
+    'members_create_room': ('create_room_in_server',),
+    'members_send_invitation_to_server': ('send_invitation',),
+    'members_delete_messages': ('delete_message_from_server',),
+    'members_send_messages': ('send_messages_in_server',),
+    'members_can_see_private_rooms': ('display_private_room_data',),
+}
+
+
+def sync_role_permissions(server_model_instance, roles):
+    """
+    Brings role groups permissions in line with server's permission settings. Allowed and forbidden
+    permissions of every role are diffed against group's current ones, only the difference is written:
+    one query reads current permissions, one inserts, one deletes.
+    """
+    permission_settings = model_to_dict(server_model_instance.permission_settings)
+    groups = Group.objects.filter(name__in=[f'{server_model_instance.name}_{role}' for role in roles])
+    group_roles = {group.pk: group.name[len(server_model_instance.name) + 1:] for group in groups}
+    GroupPermission = Group.permissions.through
+    current = set(GroupPermission.objects.filter(group__in=group_roles).values_list('group_id', 'permission_id'))
+    to_add = set()
+    to_remove = set()
+    for group_id, role in group_roles.items():
+        for field, codenames in PERMISSION_SETTINGS_CODENAMES.items():
+            if not field.startswith(f'{role}_') or permission_settings[field] not in ('Allowed', 'Forbidden'):
+                continue
+            pairs = {(group_id, permission.pk) for permission in permission_registry.get_many(codenames)}
+            if permission_settings[field] == 'Allowed':
+                to_add |= pairs - current
+            else:
+                to_remove |= pairs & current
+    if to_add:
+        GroupPermission.objects.bulk_create(
+            [GroupPermission(group_id=group_id, permission_id=permission_id) for group_id, permission_id in to_add])
+    if to_remove:
+        condition = Q()
+        for group_id, permission_id in to_remove:
+            condition |= Q(group_id=group_id, permission_id=permission_id)
+        GroupPermission.objects.filter(condition).delete()
+    #   Through rows written directly send no m2m_changed
+    if to_add or to_remove:
+        invalidate_server_permissions(server_model_instance.pk)
+    return to_add, to_remove
 
 
 def check_if_logged_user_can_change_users_group(logged_user, user_to_change, server, destined_group):
     """Only owners or masters can change others groups"""
-    server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-    permission_settings = server.permission_settings
-    owners_group = Group.objects.get(name=f'{server.name}_owners')
-    masters_group = Group.objects.get(name=f'{server.name}_masters')
-
-    owners_change_permissions = [
-        Permission.objects.get(codename='edit_moderators_group'),
-        Permission.objects.get(codename='edit_members_group'),
-        Permission.objects.get(codename='edit_masters_group')
-    ]
-
-    masters_change_permissions = [
-        Permission.objects.get(codename='edit_moderators_group'),
-        Permission.objects.get(codename='edit_members_group'),
-    ]
-    #   masters have no permission to promote to masters or owners
-    if logged_user in masters_group.user_set.all():
-        if destined_group == owners_group or destined_group == masters_group:
-            return False
-
-    for group in server_groups:
-        if user_to_change in owners_group.user_set.all():
-            return False
-        #   Owners group
-        if logged_user in group.user_set.all() and \
-        all(permission in group.permissions.all() for permission in owners_change_permissions): 
-            if user_to_change in owners_group.user_set.all():   #   Change owners is prohibited
-                return False
-            else:
-                return True
-        #   Masters group
-        if logged_user in group.user_set.all() and \
-        all(permission in group.permissions.all() for permission in masters_change_permissions): 
-            #   Check if masters have permission to change users group
-            if permission_settings.masters_can_edit_users_group == 'Forbidden' or \
-            user_to_change in owners_group.user_set.all() or \
-            user_to_change in masters_group.user_set.all():
-                return False
-            else:
-                return True
+    return can_change_member_group(server_permissions(logged_user, server), server_permissions(user_to_change, server).role,
+                                   destined_group.name[len(server.name) + 1:], server.permission_settings)
+
+
+class MemberActions:
+    """Role of one server member and what logged user may do with them"""
+    __slots__ = ('role', 'can_delete', 'assignable_roles')
+
+    def __init__(self, role, can_delete, assignable_roles):
+        self.role = role
+        self.can_delete = can_delete
+        self.assignable_roles = assignable_roles
+
+
+def server_member_actions(logged_user, server, users, server_groups):
+    """
+    Computes MemberActions of every user in member list and attaches them as `user.member_actions`.
+    Roles of all users come from one membership query, rules are evaluated once for whole list,
+    so number of queries doesn't grow with number of users.
+    """
+    users = list(users)
+    prime_server_permissions(users + [logged_user], server)
+    permissions = server_permissions(logged_user, server)
+    roles = [server_permissions(user, server).role for user in users]
+    group_roles = frozenset(group.name[len(server.name) + 1:] for group in server_groups)
+    for user, role, can_delete, assignable_roles in zip(
+        users, roles,
+        deletable_members(permissions, roles, server.permission_settings),
+        assignable_member_roles(permissions, roles, server.permission_settings),
+    ):
+        user.member_actions = MemberActions(role, can_delete, assignable_roles & group_roles)
+    return users
+
+
+def friend_request_pair(user, other_user):
+    """FriendRequest filter of pair of users in both directions, served by (sender, receiver) index"""
+    return Q(sender=user, receiver=other_user) | Q(sender=other_user, receiver=user)
@@ -1,5 +1,5 @@
 from typing import Any, Dict, Optional
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.forms.models import BaseModelForm, model_to_dict
@@ -21,13 +21,18 @@ from django.contrib.auth.models import Group, Permission
 from django.utils import timezone
 
 from .models import Room, Notification, FriendRequest, ServerInvite, Message, ServerPermissionSettings, Server, \
-                 UserPermissionSettings, Chat
+                 UserPermissionSettings, Chat, ServerMembership
 from .forms import ResetPasswordForm, SearchForm, SendMessageForm, ServerPermissionsForm, ServerEditForm, \
                 UserPermissionForm, SearchUserForm
 from .permissions import *
+from .permission_registry import permission_registry
+from .access import publish_access_change, server_permissions, server_group_names
+from .events import publish_message_edit, publish_message_delete
+from .pagination import KeysetPaginationMixin, messages_before
 from .context_processor import *
-from .utils import check_if_logged_user_can_delete_user, set_masters_permissions, initial_server_permissions, \
-            set_moderators_permissions, set_members_permissions, check_if_logged_user_can_change_users_group, set_permission
+from .utils import check_if_logged_user_can_delete_user, initial_server_permissions, create_server_groups, \
+            check_if_logged_user_can_change_users_group, sync_role_permissions, server_member_actions, \
+            friend_request_pair
 
 
 User = get_user_model()
@@ -52,7 +57,7 @@ class CreateServer(LoginRequiredMixin, CreateView):
         permission_settings = ServerPermissionSettings.objects.create()
         form.instance.permission_settings = permission_settings
         server = form.save()
-        server.users.add(self.request.user)
+        server.users.add(self.request.user, through_defaults={'role': 'owners'})
         return super().form_valid(form)
     
     def get_success_url(self):
@@ -69,24 +74,22 @@ class GiveInitialPermissions(LoginRequiredMixin, CreateView):
     def get_object(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        if self.request.user == server.creator:
+        if self.request.user.pk == server.creator_id:
             return server
         else:
             raise PermissionDenied
     
     def get(self, request, *args, **kwargs):
         server = self.get_object()
-        room = Room.objects.create(name='general', server=server)
-        # Create server groups
-        server_owners, created = Group.objects.get_or_create(name=f'{server.name}_owners')
-        server_masters, is_created = Group.objects.get_or_create(name=f'{server.name}_masters')
-        server_moderators, status = Group.objects.get_or_create(name=f'{server.name}_moderators')  
-        server_members, created = Group.objects.get_or_create(name=f'{server.name}_members')
-        
-        server_owners.user_set.add(self.request.user)
+        with transaction.atomic():
+            room = Room.objects.create(name='general', server=server)
+            # Create server groups - utils.py file
+            server_owners, server_masters, server_moderators, server_members = create_server_groups(server)
+
+            ServerMembership.objects.update_or_create(server=server, user=self.request.user, defaults={'role': 'owners'})
 
-        # Give initial permissions to server groups - permissions.py file
-        initial_server_permissions(server_owners, server_masters, server_moderators, server_members)
+            # Give initial permissions to server groups - utils.py file
+            initial_server_permissions(server_owners, server_masters, server_moderators, server_members)
 
         return redirect(reverse('server_detail', kwargs={'pk': server.pk}))
     
@@ -99,7 +102,7 @@ class ServerLeaveConfirm(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     template_name = 'viperchat/server_leave_confirm.html'
 
     def test_func(self):
-        if self.request.user in self.get_object().users.all():
+        if server_permissions(self.request.user, self.get_object()).is_member:
             return True
         raise PermissionDenied
 
@@ -126,27 +129,21 @@ class ServerLeave(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Server
     
     def test_func(self):
-        server_owners = Group.objects.get(name=f'{self.get_object().name}_owners')
-        if self.request.user in server_owners.user_set.all() and self.get_object().users.all().count() == 1:
-            return True
-        if self.request.user in server_owners.user_set.all() and server_owners.user_set.all().count() > 1:
-            return True
-        if self.request.user in server_owners.user_set.all() and \
-        server_owners.user_set.all().count() == 1 and \
-        self.get_object().users.all().count() > 1:
-            return False
-        if self.request.user in self.get_object().users.all():
-            return True   
+        server = self.get_object()
+        role = server_permissions(self.request.user, server).role
+        #   Last owner can leave only empty server
+        if role == 'owners':
+            return server.users.count() == 1 or server.memberships.filter(role='owners').count() > 1
+        return role is not None
 
     def get_object(self):
         server = Server.objects.get(id=self.kwargs['pk'])
         return server
     
     def get(self, *args, **kwargs):
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
-        user_group = [group for group in server_groups if self.request.user in group.user_set.all()][0]
-        self.get_object().users.remove(self.request.user)
-        user_group.user_set.remove(self.request.user)
+        server = self.get_object()
+        server.users.remove(self.request.user)
+        publish_access_change(server, self.request.user)
         return redirect(reverse('home'))
 
     def get_context_name(self, **kwargs):
@@ -167,7 +164,7 @@ class ServerDetails(LoginRequiredMixin, DetailView):
     def get_queryset(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        if self.request.user in server.users.all():
+        if server_permissions(self.request.user, server).is_member:
             return super().get_queryset()
         elif server.is_private == False:
             return super().get_queryset()
@@ -176,27 +173,20 @@ class ServerDetails(LoginRequiredMixin, DetailView):
         
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
-        owners_group = Group.objects.get(name=f'{self.get_object().name}_owners')
-        context['server_groups'] = server_groups
-        context['server'] = self.get_object()
-        context['owners_group'] = owners_group
+        context['server'] = self.object
         return context
             
 
 class CreateRoom(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = Room
-    fields = ['name', 'description', 'is_private']
+    fields = ['name', 'description', 'is_private', 'slow_mode']
 
     def test_func(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-        create_permission = Permission.objects.get(codename='create_room_in_server')
         #   Check if user has permission to create room
-        for group in server_groups:
-            if self.request.user in group.user_set.all() and create_permission in group.permissions.all():
-                return True
+        if server_permissions(self.request.user, server).has('create_room_in_server'):
+            return True
         raise PermissionDenied
 
     def get_object(self):
@@ -215,15 +205,12 @@ class CreateRoom(LoginRequiredMixin, UserPassesTestMixin, CreateView):
 
 class RoomEdit(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Room
-    fields = ['name', 'description', 'is_private']
+    fields = ['name', 'description', 'is_private', 'slow_mode']
     template_name = 'viperchat/room_edit.html'
 
     def test_func(self):
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().server.name}_')
-        permission = Permission.objects.get(codename='edit_rooms_in_server')
-        logged_user_group = [group for group in server_groups if self.request.user in group.user_set.all()]
         #   Check if user has permission to edit room data
-        if permission in logged_user_group[0].permissions.all():
+        if server_permissions(self.request.user, self.get_object().server).has('edit_rooms_in_server'):
             return True
         raise PermissionDenied
     
@@ -247,17 +234,21 @@ class DeleteMessage(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
             return True
         else:
             server = self.get_object().room.server
-            delete_message_permission = Permission.objects.get(codename='delete_message_from_server')
-            server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-            for group in server_groups:
-                if logged_user in group.user_set.all() and delete_message_permission in group.permissions.all():
-                    return True
+            if server_permissions(logged_user, server).has('delete_message_from_server'):
+                return True
         raise PermissionDenied
 
     def get_object(self, *args, **kwargs):
         message_id = self.kwargs['pk']
         message = Message.objects.get(id=message_id)
         return message
+
+    def form_valid(self, form):
+        #   Deleted instance loses its id, tombstone is built from message loaded separately
+        message = self.get_object()
+        response = super().form_valid(form)
+        publish_message_delete(message)
+        return response
         
     def get_success_url(self):
         room = self.get_object().room
@@ -288,10 +279,8 @@ class JoinServer(LoginRequiredMixin, UpdateView):
     
     def get(self, request, *args, **kwargs):
         server = self.get_object()
-        member_group = Group.objects.get(name=f'{server.name}_members')
         if server.is_private == False:
             server.users.add(self.request.user)
-            member_group.user_set.add(self.request.user)
             server.save()
             return redirect(reverse('server_detail', kwargs={'pk': server.pk}))
         else:
@@ -305,15 +294,12 @@ class ServerInviteSend(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     model = ServerInvite
 
     def test_func(self):
-        invite_to_server_permission = Permission.objects.get(codename='send_invitation')
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
         invite_receiver = User.objects.get(username=self.kwargs['username'])
-        user_group = [group for group in server_groups if self.request.user in group.user_set.all()][0]
         invite = ServerInvite.objects.filter(server=self.get_object(), receiver=invite_receiver)
         #   Check if server invite already exists
         if invite:
             raise PermissionDenied
-        if invite_to_server_permission in user_group.permissions.all():
+        if server_permissions(self.request.user, self.get_object()).has('send_invitation'):
             return True
         if invite_receiver in self.object().users.all():
             raise PermissionDenied
@@ -355,10 +341,7 @@ class SearchUserToInvite(LoginRequiredMixin, UserPassesTestMixin, FormView):
     form_class = SearchUserForm
     
     def test_func(self):
-        invite_to_server_permission = Permission.objects.get(codename='send_invitation')
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
-        user_group = [group for group in server_groups if self.request.user in group.user_set.all()][0]
-        if invite_to_server_permission in user_group.permissions.all():
+        if server_permissions(self.request.user, self.get_object()).has('send_invitation'):
             return True
         raise PermissionDenied
 
@@ -377,7 +360,7 @@ class SearchUserToInvite(LoginRequiredMixin, UserPassesTestMixin, FormView):
         context = super().get_context_data(**kwargs)
         context['server_invites'] = ServerInvite.objects.filter(server=self.get_object())
         context['server'] = self.get_object()
-        context['server_groups'] = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
+        context['server_groups'] = Group.objects.filter(name__in=server_group_names(self.get_object()))
         return context
 
 
@@ -393,16 +376,13 @@ class RoomDetail(LoginRequiredMixin, UserPassesTestMixin, FormMixin, DetailView)
     def test_func(self):
         server_id = self.kwargs['server_id']
         server = Server.objects.get(id=server_id)
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
         room = self.get_object()
-        show_private_room_permission = Permission.objects.get(codename='display_private_room_data')
-        send_message_permission = Permission.objects.get(codename='send_messages_in_server')
-        logged_user_group = [group for group in server_groups if self.request.user in group.user_set.all()]
-        if not send_message_permission in logged_user_group[0].permissions.all():
+        permissions = server_permissions(self.request.user, server)
+        if not permissions.has('send_messages_in_server'):
             raise PermissionDenied
-        if room.is_private == True and show_private_room_permission in logged_user_group[0].permissions.all():
+        if room.is_private == True and permissions.has('display_private_room_data'):
             return True
-        elif room.is_private == False and self.request.user in server.users.all():
+        elif room.is_private == False and permissions.is_member:
             return True
         else:
             raise PermissionDenied
@@ -414,26 +394,19 @@ class RoomDetail(LoginRequiredMixin, UserPassesTestMixin, FormMixin, DetailView)
         
     def get_context_data(self,  *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        logged_user = self.request.user
-        server_id = self.kwargs['server_id']
-        server = Server.objects.get(id=server_id)
-        delete_message_permission = Permission.objects.get(codename='delete_message_from_server')
-        send_message_permission = Permission.objects.get(codename='send_messages_in_server')
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')    # Get all server groups
-        context['all_messages'] = Message.objects.filter(room=self.get_object())
+        #   Only last page, older messages are loaded through websocket
+        context['all_messages'], context['history_cursor'] = messages_before(
+            Message.objects.filter(room=self.get_object()).select_related('author'))
         context['form'] = SendMessageForm()
         context['server'] = self.get_object().server
-        context['server_groups'] = server_groups
-        context['send_message_permission'] = send_message_permission
         context['room_id'] = self.get_object().id
         context['server_id'] = self.get_object().server.id
-        for group in server_groups:
-            if logged_user in group.user_set.all() and delete_message_permission in group.permissions.all():
-                context["deleters"] = group.user_set.all()
+        #   Client resumes from here after reconnect
+        context['last_sequence'] = max((message.sequence or 0 for message in context['all_messages']), default=0)
         return context
     
 
-class RoomMessagesManage(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class RoomMessagesManage(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     """
     User can manage others messages
     """
@@ -442,18 +415,14 @@ class RoomMessagesManage(LoginRequiredMixin, UserPassesTestMixin, ListView):
     context_object_name = 'room_messages'
 
     def test_func(self):
-        delete_message_permission = Permission.objects.get(codename='delete_message_from_server')
         server = Server.objects.get(id=self.kwargs['server_id'])
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-        user_group = [group for group in server_groups if self.request.user in group.user_set.all()]
-        if delete_message_permission in user_group[0].permissions.all():
+        if server_permissions(self.request.user, server).has('delete_message_from_server'):
             return True
         return False
     
     def get_queryset(self):
-        room = Room.objects.get(id=self.kwargs['pk'])
-        messages = Message.objects.filter(room=room).order_by('-date_created')
-        return messages
+        #   Ordered by KeysetPaginationMixin
+        return Message.objects.filter(room=self.kwargs['pk']).select_related('author')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -461,7 +430,7 @@ class RoomMessagesManage(LoginRequiredMixin, UserPassesTestMixin, ListView):
         return context
 
 
-class RoomUserOwnMessages(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class RoomUserOwnMessages(LoginRequiredMixin, UserPassesTestMixin, KeysetPaginationMixin, ListView):
     """
     Delete and editing own messages
     """
@@ -471,14 +440,12 @@ class RoomUserOwnMessages(LoginRequiredMixin, UserPassesTestMixin, ListView):
 
     def test_func(self):
         room = Room.objects.get(id=self.kwargs['pk'])
-        if self.request.user in room.server.users.all():
+        if server_permissions(self.request.user, room.server).is_member:
             return True
         return False
 
     def get_queryset(self):
-        room = Room.objects.get(id=self.kwargs['pk'])
-        user_messages_in_room = Message.objects.filter(room=room, author=self.request.user)
-        return user_messages_in_room
+        return Message.objects.filter(room=self.kwargs['pk'], author=self.request.user).select_related('author')
     
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -494,8 +461,7 @@ class ServerEdit(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        owners_group = Group.objects.get(name=f'{server.name}_owners')
-        if self.request.user in owners_group.user_set.all():
+        if server_permissions(self.request.user, server).role == 'owners':
             return True
         else: 
             raise PermissionDenied
@@ -515,8 +481,7 @@ class ServerGroupsManagement(LoginRequiredMixin, UserPassesTestMixin, UpdateView
     def test_func(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        owners_group = Group.objects.get(name=f'{server.name}_owners')
-        if self.request.user in owners_group.user_set.all():
+        if server_permissions(self.request.user, server).role == 'owners':
             return True
         else:
             raise PermissionDenied
@@ -541,8 +506,7 @@ class ServerPermissionChange(LoginRequiredMixin, UserPassesTestMixin, UpdateView
     def test_func(self):
         server_id = self.kwargs['pk']
         server = Server.objects.get(id=server_id)
-        owners_group = Group.objects.get(name=f'{server.name}_owners')
-        if self.request.user in owners_group.user_set.all():
+        if server_permissions(self.request.user, server).role == 'owners':
             return True
         else:
             raise PermissionDenied
@@ -552,11 +516,11 @@ class ServerPermissionChange(LoginRequiredMixin, UserPassesTestMixin, UpdateView
         return server
     
     def get(self, *args, **kwargs):
-        #   Set groups permissions functions are in utils.py file
-        set_masters_permissions(self.get_object())
-        set_moderators_permissions(self.get_object())
-        set_members_permissions(self.get_object())
-        return redirect(reverse('server_detail', kwargs={'pk': self.get_object().id}))
+        server = self.get_object()
+        #   Sync groups permissions function is in utils.py file
+        sync_role_permissions(server, ['masters', 'moderators', 'members'])
+        publish_access_change(server)
+        return redirect(reverse('server_detail', kwargs={'pk': server.id}))
         
 
 class ServerUsersManage(LoginRequiredMixin, UserPassesTestMixin, ListView):
@@ -568,28 +532,28 @@ class ServerUsersManage(LoginRequiredMixin, UserPassesTestMixin, ListView):
     template_name = 'viperchat/server_users_list.html'
     
     def test_func(self):
-        delete_users_permission = Permission.objects.get(codename='delete_user_from_server')
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
-        for group in server_groups:
-            if self.request.user in group.user_set.all() and delete_users_permission in group.permissions.all():
-                return True
+        if server_permissions(self.request.user, self.get_object()).has('delete_user_from_server'):
+            return True
         raise PermissionDenied
 
     def get_object(self, *args, **kwargs):
         return Server.objects.get(id=self.kwargs['server_id'])
     
     def get_queryset(self):
-        logged_user = self.request.user
-        if logged_user in self.get_object().users.all():
-            return self.get_object().users.all()
+        server = self.get_object()
+        if server_permissions(self.request.user, server).is_member:
+            return server.users.all()
         else:
             raise PermissionDenied
         
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        server_groups = Group.objects.filter(name__startswith=f'{self.get_object().name}_')
+        server = self.get_object()
+        server_groups = list(Group.objects.filter(name__in=server_group_names(server)))
+        #   Role and allowed actions of every listed user, read by template tags - utils.py file
+        server_member_actions(self.request.user, server, context['users'], server_groups)
         context['server_groups'] = server_groups
-        context['server'] = self.get_object()
+        context['server'] = server
         return context
 
 
@@ -602,11 +566,8 @@ class UserGroupEdit(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
 
     def test_func(self):
         server = Server.objects.get(id=self.kwargs['server_id'])
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-        edit_group_permission = Permission.objects.get(codename='change_user_group')
-        for group in server_groups:
-            if self.request.user in group.user_set.all() and edit_group_permission in group.permissions.all():
-                return True
+        if server_permissions(self.request.user, server).has('change_user_group'):
+            return True
         raise PermissionDenied
     
     def get_object(self):
@@ -618,13 +579,15 @@ class UserGroupEdit(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         group = Group.objects.get(name=self.kwargs['name'])
         user_to_change = self.get_object()
         server = Server.objects.get(id=self.kwargs['server_id'])
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-        #   Get changing user group
-        user_to_change_group = [group for group in server_groups if user_to_change in group.user_set.all()]
+        #   Destined group must be one of this server's role groups
+        if group.name not in server_group_names(server):
+            raise PermissionDenied
         #   function details in utils.py file
         if check_if_logged_user_can_change_users_group(self.request.user, user_to_change, server, group) == True:
-            user_to_change_group[0].user_set.remove(user_to_change)
-            group.user_set.add(user_to_change)
+            membership = ServerMembership.objects.get(server=server, user=user_to_change)
+            membership.role = group.name[len(server.name) + 1:]
+            membership.save(update_fields=['role'])
+            publish_access_change(server, user_to_change)
             return redirect(reverse('server_users_list', kwargs={'server_id': server.id}))
         else:
             raise PermissionDenied
@@ -659,11 +622,8 @@ class DeleteUserFromServer(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     def test_func(self):
         server_id = self.kwargs['server_id']
         server = Server.objects.get(id=server_id)
-        server_groups = Group.objects.filter(name__startswith=f'{server.name}_')
-        delete_permission = Permission.objects.get(codename='delete_user_from_server')
-        for group in server_groups:
-            if self.request.user in group.user_set.all() and delete_permission in group.permissions.all():
-                return True
+        if server_permissions(self.request.user, server).has('delete_user_from_server'):
+            return True
         raise PermissionDenied
 
     def get_object(self):
@@ -676,17 +636,10 @@ class DeleteUserFromServer(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         server = Server.objects.get(id=server_id)
         logged_user = self.request.user
         user_to_delete = self.get_object()
-        owners_group = Group.objects.get(name=f'{server.name}_owners')
-        masters_group = Group.objects.get(name=f'{server.name}_masters')
-        members_group = Group.objects.get(name=f'{server.name}_members')
-        moderators_group = Group.objects.get(name=f'{server.name}_moderators')
         #   check_if_logged_user_can_delete_user is in utils.py file
         if check_if_logged_user_can_delete_user(logged_user, user_to_delete, server) == True:
-            owners_group.user_set.remove(user_to_delete)
-            masters_group.user_set.remove(user_to_delete)
-            members_group.user_set.remove(user_to_delete)
-            moderators_group.user_set.remove(user_to_delete)
             server.users.remove(user_to_delete)
+            publish_access_change(server, user_to_delete)
             return redirect(reverse('server_users_list', kwargs={'server_id': server_id}))
         else:
             raise PermissionDenied
@@ -711,8 +664,10 @@ class UserProfile(LoginRequiredMixin, FormMixin, DetailView):
         friend request display add friend or cancel friend request
         """
         context = super().get_context_data(**kwargs)
-        friend_request = FriendRequest.objects.filter(sender=self.request.user, receiver=self.get_object())
-        friend_request_mirror = FriendRequest.objects.filter(sender=self.get_object(), receiver=self.request.user)
+        #   Pair has at most one request (unique_friend_request_pair), one lookup finds it in either direction
+        friend_requests = list(FriendRequest.objects.filter(friend_request_pair(self.request.user, self.object)))
+        friend_request = [request for request in friend_requests if request.sender_id == self.request.user.pk]
+        friend_request_mirror = [request for request in friend_requests if request.sender_id != self.request.user.pk]
         user_profile_settings = UserPermissionSettings.objects.get(user=self.get_object())
         context['user_settings'] = user_profile_settings
         context['friend_request'] = friend_request
@@ -774,10 +729,8 @@ class ServerInviteDetail(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     
     def post(self, request,*args, **kwargs):
         invite = self.get_object()
-        members_group = Group.objects.get(name=f'{invite.server.name}_members')
         if 'accept_button' in self.request.POST:
             invite.server.users.add(self.request.user)
-            members_group.user_set.add(self.request.user)
             invite.status = 'accepted'
         if 'decline_button' in self.request.POST:
             invite.status = 'declined'
@@ -804,6 +757,7 @@ class MessageEdit(LoginRequiredMixin, UpdateView):
     def form_valid(self, form):
         form.instance.date_edited = timezone.now()
         form.save()
+        publish_message_edit(form.instance)
         return redirect(self.get_success_url())
         
     def get_success_url(self):
@@ -861,7 +815,7 @@ class UserProfilePermissions(LoginRequiredMixin, UserPassesTestMixin, UpdateView
 
     def form_valid(self, form):
         user_profile_display_permission_setting = form.cleaned_data['everyone_see_your_profile']
-        only_friend_see_profile_permission = Permission.objects.get(codename='friends_see_profile')
+        only_friend_see_profile_permission = permission_registry.get('friends_see_profile', User)
         if user_profile_display_permission_setting == 'Allowed':
             self.request.user.user_permissions.remove(only_friend_see_profile_permission)
         if user_profile_display_permission_setting == 'Forbidden':
@@ -978,13 +932,15 @@ class FriendNotifiaction(LoginRequiredMixin, CreateView):
         receiver = self.get_object()
         description = f"{self.request.user.username} wants to join your friendlist"
 
-        if FriendRequest.objects.filter(sender=sender, receiver=receiver).exists() \
-        or FriendRequest.objects.filter(sender=receiver, receiver=sender).exists() \
-        or receiver in sender.friends.all():
+        if FriendRequest.objects.filter(friend_request_pair(sender, receiver)).exists() \
+        or sender.friends.filter(pk=receiver.pk).exists():
             raise PermissionDenied
-        else:
-            FriendRequest.objects.create(sender=sender, receiver=receiver, description=description)
-            return redirect(self.get_success_url())
+        try:
+            with transaction.atomic():
+                FriendRequest.objects.create(sender=sender, receiver=receiver, description=description)
+        except IntegrityError:     # Other request of this pair was created meanwhile
+            raise PermissionDenied
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('user_detail', kwargs={'username': self.get_object().username})
@@ -1011,6 +967,7 @@ class NotificationList(LoginRequiredMixin, ListView):
             raise PermissionDenied
         else:
             context['notifications'] = notifications
+            context['unread_count'] = notifications.filter(is_read=False).count()
             return context
         
 
@@ -1078,6 +1035,7 @@ class NotificationsReadList(LoginRequiredMixin, UserPassesTestMixin, ListView):
         context = super().get_context_data(**kwargs)
         notifications = Notification.objects.filter(receiver=self.request.user)
         context['notifications'] = notifications
+        context['unread_count'] = notifications.filter(is_read=False).count()
         return context
     
 
@@ -1093,7 +1051,10 @@ class Notifications(LoginRequiredMixin, UserPassesTestMixin, View):
     
     def get(self, request,  *args, **kwargs):
         notifications = Notification.objects.filter(receiver=self.request.user)
-        return render(request, 'viperchat/notifications.html', {'notifications': notifications})
+        return render(request, 'viperchat/notifications.html', {
+            'notifications': notifications,
+            'unread_count': notifications.filter(is_read=False).count(),
+        })
 
 
 class NotificationUnreadList(LoginRequiredMixin, UserPassesTestMixin, ListView):
@@ -1113,6 +1074,7 @@ class NotificationUnreadList(LoginRequiredMixin, UserPassesTestMixin, ListView):
         context = super().get_context_data(**kwargs)
         notifications = Notification.objects.filter(receiver=self.request.user)
         context['notifications'] = notifications
+        context['unread_count'] = notifications.filter(is_read=False).count()
         return context
     
 
@@ -1323,5 +1285,6 @@ class ChatDetails(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['participants'] = self.get_object().participants.all()
-        context['all_messages'] = Message.objects.filter(chat=self.get_object())
+        context['all_messages'], context['history_cursor'] = messages_before(
+            Message.objects.filter(chat=self.get_object()).select_related('author'))
         return context
\ No newline at end of file